@@ -0,0 +1,271 @@
+# -*- coding: utf-8 -*-
+import os
+import sys
+import json
+import time
+import shutil
+import subprocess
+import argparse
+import contextlib
+import platform
+import tempfile
+import numpy as np
+import scipy
+from surface import Surface
+
+
+# Stage benchmark on synthetic wing meshes.
+#
+#   python benchmark.py --sizes 1000 10000 100000 --output bench.json
+#
+# For each size a tri input mesh of about that many elements and a quad
+# output mesh about `ratio` times coarser are written in the text formats
+# read by Surface, then every stage is timed separately. Each size is run
+# again in single precision and its coefficients compared with the double
+# precision ones. The bundled press_wing case 1 is also run and compared with
+# the output of the original code in resources/reference.
+
+
+def wing_grids(nx, ny, span=10.0, chord=2.0, taper=0.5, dz=0.0):
+
+    # Tapered, swept and slightly cambered wing surface, (nx + 1) x (ny + 1) grids
+    u, v = np.meshgrid(np.linspace(0.0, 1.0, nx + 1), np.linspace(0.0, 1.0, ny + 1), indexing='ij')
+    c = chord * (1.0 - (1.0 - taper) * v)
+    x = 0.3 * span * v + c * u
+    y = span * v
+    z = 0.05 * c * np.sin(np.pi * u) + 0.1 * span * v ** 2 + dz
+    return np.column_stack((x.ravel(), y.ravel(), z.ravel()))
+
+
+def wing_quads(nx, ny):
+
+    i, j = np.meshgrid(np.arange(nx), np.arange(ny), indexing='ij')
+    g = (i * (ny + 1) + j).ravel() + 1
+    return np.column_stack((g, g + ny + 1, g + ny + 2, g + 1))
+
+
+def wing_trias(nx, ny):
+
+    q = wing_quads(nx, ny)
+    return np.vstack((q[:, [0, 1, 2]], q[:, [0, 2, 3]]))
+
+
+def write_grids(filepath, grids):
+
+    with open(filepath, 'w') as file:
+        file.write("{:d}\n".format(len(grids)))
+        np.savetxt(file, np.column_stack((np.arange(1, len(grids) + 1), grids)), fmt="%8d %11.6f %11.6f %11.6f")
+
+
+def write_elements(filepath, elements):
+
+    with open(filepath, 'w') as file:
+        file.write("{:d}\n".format(len(elements)))
+        np.savetxt(file, elements, fmt="%8d")
+
+
+def write_press(filepath, centers):
+
+    press = -0.5 * np.sin(np.pi * centers[:, 0] / centers[:, 0].max()) * (1.0 - centers[:, 1] / centers[:, 1].max())
+    np.savetxt(filepath, np.column_stack((np.arange(1, len(press) + 1), press)), fmt="%8d %11.6f")
+
+
+def make_case(data_dir, nelements, ratio):
+
+    # Input: nelements triangles, output: nelements / ratio quads
+    ny = max(int(round(np.sqrt(nelements / 2 / 4))), 1)
+    nx = max(int(round(nelements / 2 / ny)), 1)
+    k = max(int(round(np.sqrt(ratio / 2))), 1)
+    igrids = wing_grids(nx, ny, dz=1e-3)
+    ogrids = wing_grids(max(nx // k, 1), max(ny // k, 1))
+
+    write_grids(os.path.join(data_dir, "i_grids.txt"), igrids)
+    write_elements(os.path.join(data_dir, "i_elements.txt"), wing_trias(nx, ny))
+    write_grids(os.path.join(data_dir, "o_grids.txt"), ogrids)
+    write_elements(os.path.join(data_dir, "o_elements.txt"), wing_quads(max(nx // k, 1), max(ny // k, 1)))
+
+
+def timed(stages, name, function, *args, **kwargs):
+
+    wall = time.perf_counter()
+    cpu = time.process_time()
+    result = function(*args, **kwargs)
+    stages[name] = {"wall": time.perf_counter() - wall, "cpu": time.process_time() - cpu}
+    return result
+
+
+def mesh_bytes(mesh):
+
+    # Arrays held by a mesh after a case
+    arrays = [value for value in vars(mesh).values() if isinstance(value, np.ndarray)]
+    if hasattr(mesh, "transfer"):
+        arrays += [mesh.transfer.data, mesh.transfer.indices, mesh.transfer.indptr]
+    return int(sum(array.nbytes for array in arrays))
+
+
+def run_case(nelements, ratio, work_dir, dtype=np.float64):
+
+    data_dir = os.path.join(work_dir, "data")
+    results_dir = os.path.join(work_dir, "results")
+    os.makedirs(data_dir, exist_ok=True)
+    os.makedirs(results_dir, exist_ok=True)
+
+    if not os.path.exists(os.path.join(data_dir, "o_elements.txt")):
+        make_case(data_dir, nelements, ratio)
+
+    imesh = Surface(3)
+    omesh = Surface(4)
+    for mesh in (imesh, omesh):
+        mesh.sidecar = False
+        mesh.results_dir = results_dir
+        mesh.dtype = dtype
+
+    stages = {}
+
+    def read():
+        imesh.read_grids(data_dir, "i_grids.txt")
+        imesh.read_elements(data_dir, "i_elements.txt")
+        omesh.read_grids(data_dir, "o_grids.txt")
+        omesh.read_elements(data_dir, "o_elements.txt")
+
+    def centers_area():
+        for mesh in (imesh, omesh):
+            mesh.calc_panel_centers()
+            mesh.calc_area()
+
+    timed(stages, "read", read)
+    timed(stages, "centers_area", centers_area)
+
+    if not os.path.exists(os.path.join(data_dir, "dpress_1.txt")):
+        write_press(os.path.join(data_dir, "dpress_1.txt"), imesh.centers)
+    timed(stages, "read_press", imesh.read_press, data_dir, "dpress_1.txt", 1)
+
+    timed(stages, "mapgrids", omesh.mapgrids, imesh.centers, imesh.nelements, 0)
+    timed(stages, "projectmesh", omesh.projectmesh, imesh.centers, imesh.area, imesh.press, 0)
+
+    def intmesh():
+        imesh.intmesh(None)
+        omesh.intmesh2(None)
+
+    def writers():
+        omesh.write_projected_mesh("forces_1.txt")
+        imesh.intmesh("forces_1_input_int.txt")
+
+    timed(stages, "intmesh", intmesh)
+    coefficients = np.concatenate((imesh.integrated_forces, imesh.integrated_moments,
+                                   omesh.integrated_forces, omesh.integrated_moments))
+    timed(stages, "writers", writers)
+
+    mapped = int(np.count_nonzero(omesh.mapg >= 0))
+
+    return {"input_elements": imesh.nelements, "output_elements": omesh.nelements,
+            "mapped_points": mapped, "mesh_bytes": mesh_bytes(imesh) + mesh_bytes(omesh),
+            "coefficients": coefficients.tolist(), "stages": stages}
+
+
+def run_single(case, nelements, ratio, work_dir):
+
+    # Same case in single precision, coefficients against the double ones
+    single = run_case(nelements, ratio, work_dir, np.float32)
+    diff = np.abs(np.array(single["coefficients"]) - np.array(case["coefficients"]))
+
+    return {"mesh_bytes": single["mesh_bytes"], "max_abs_coefficient_diff": float(diff.max()),
+            "mapped_points": single["mapped_points"], "stages": single["stages"]}
+
+
+def check_reference(work_dir, rtol=1e-6, atol=1e-9):
+
+    # Bundled right wing, load case 1, against the results of the original
+    # code kept in resources/reference (src/results is rewritten by every run)
+    results_dir = os.path.join(work_dir, "reference")
+    reference_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), "../resources/reference")
+    os.makedirs(results_dir, exist_ok=True)
+
+    imesh = Surface(3)
+    omesh = Surface(4)
+    for mesh in (imesh, omesh):
+        mesh.sidecar = False
+        mesh.results_dir = results_dir
+
+    imesh.read_grids("press_wing", "i_grids.txt")
+    imesh.read_elements("press_wing", "i_elements.txt")
+    imesh.calc_area()
+    omesh.read_grids("press_wing", "o_grids.txt")
+    omesh.read_elements("press_wing", "o_elements.txt")
+    omesh.mapgrids(imesh.centers, imesh.nelements, 0)
+    omesh.calc_area()
+    imesh.read_press("press_wing", "dpress_1.txt", 1)
+    omesh.projectmesh(imesh.centers, imesh.area, imesh.press, 0)
+    omesh.write_projected_mesh("forces_1.txt")
+    imesh.intmesh("forces_1_input_int.txt")
+
+    # Every value of forces_1.txt (centers, forces, areas) and of the input
+    # and output coefficients
+    checks = ("forces_1.txt", "forces_1_input_int.txt", "forces_1_output_int.txt")
+    ok = True
+    diff = 0.0
+
+    for fout in checks:
+        reference = np.atleast_2d(np.loadtxt(os.path.join(reference_dir, fout)))
+        result = np.atleast_2d(np.loadtxt(os.path.join(results_dir, fout)))
+        if result.shape != reference.shape:
+            ok, diff = False, None
+            break
+        ok = ok and np.allclose(result, reference, rtol=rtol, atol=atol)
+        diff = max(diff, float(np.abs(result - reference).max()))
+
+    return {"case": "press_wing/dpress_1.txt", "ok": bool(ok), "max_abs_diff": diff, "rtol": rtol, "atol": atol,
+            "files": sorted(checks)}
+
+
+def revision():
+
+    try:
+        out = subprocess.run(["git", "describe", "--always", "--dirty"], capture_output=True, text=True,
+                             cwd=os.path.dirname(os.path.abspath(__file__)))
+        return out.stdout.strip() or None
+    except OSError:
+        return None
+
+
+def main():
+
+    parser = argparse.ArgumentParser(description="Stage benchmark on synthetic wing meshes")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1000, 10000, 100000], help="input elements per case")
+    parser.add_argument("--ratio", type=float, default=20.0, help="input elements per output element")
+    parser.add_argument("--output", help="JSON report file (stdout if omitted)")
+    parser.add_argument("--keep", action="store_true", help="keep the generated meshes")
+    args = parser.parse_args()
+
+    work_dir = tempfile.mkdtemp(prefix="project-mesh-bench-")
+
+    report = {"revision": revision(), "python": platform.python_version(), "numpy": np.__version__, "scipy": scipy.__version__,
+              "machine": platform.machine(), "cases": []}
+
+    # Progress output of the stages goes to stderr, stdout is for the report
+    try:
+        with contextlib.redirect_stdout(sys.stderr):
+            for n in args.sizes:
+                case_dir = os.path.join(work_dir, str(n))
+                case = run_case(n, args.ratio, case_dir)
+                case["single"] = run_single(case, n, args.ratio, case_dir)
+                report["cases"].append(case)
+                print("{:>9d} elements done".format(n))
+            report["reference"] = check_reference(work_dir)
+    finally:
+        if not args.keep:
+            shutil.rmtree(work_dir, ignore_errors=True)
+
+    text = json.dumps(report, indent=2)
+
+    if args.output:
+        with open(args.output, 'w') as file:
+            file.write(text + "\n")
+    else:
+        print(text)
+
+    return 0 if report["reference"]["ok"] else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
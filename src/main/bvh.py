@@ -0,0 +1,205 @@
+# -*- coding: utf-8 -*-
+import numpy as np
+from scipy.spatial import cKDTree
+
+
+class TriangleBVH:
+    # Bounding volume hierarchy over triangles for nearest-triangle queries in
+    # 3-D. Triangles are sorted along a Morton curve of their centroids and
+    # grouped by leaf_size into the leaves of a complete binary tree, stored
+    # level by level: node k of a level has children 2k and 2k + 1 below.
+    # A k-d tree of the centroids gives each query a first upper bound.
+    def __init__(self, triangles, leaf_size=4):
+
+        # triangles: (m, 3, 3) node coordinates
+        self.triangles = np.asarray(triangles, dtype=np.float64)
+        self.leaf_size = int(leaf_size)
+
+        ntriangles = len(self.triangles)
+        nleaves = max(-(-ntriangles // self.leaf_size), 1)
+        self.depth = int(np.ceil(np.log2(nleaves)))
+
+        centroids = self.triangles.mean(axis=1)
+        self.centroids = cKDTree(centroids)
+        order = np.argsort(morton_codes(centroids), kind='stable')
+
+        # Triangle in every leaf slot, -1 for the padding of the last leaves,
+        # and its box
+        self.slot_triangles = np.full((2 ** self.depth) * self.leaf_size, -1, dtype=np.intp)
+        self.slot_triangles[:ntriangles] = order
+
+        self.slot_lo = np.full((len(self.slot_triangles), 3), np.inf)
+        self.slot_hi = np.full((len(self.slot_triangles), 3), -np.inf)
+        self.slot_lo[:ntriangles] = self.triangles[order].min(axis=1)
+        self.slot_hi[:ntriangles] = self.triangles[order].max(axis=1)
+
+        # Boxes from the leaves up to the root, self.lo[0] is the root
+        self.lo = [self.slot_lo.reshape(-1, self.leaf_size, 3).min(axis=1)]
+        self.hi = [self.slot_hi.reshape(-1, self.leaf_size, 3).max(axis=1)]
+        for level in range(self.depth):
+            self.lo.insert(0, np.minimum(self.lo[0][0::2], self.lo[0][1::2]))
+            self.hi.insert(0, np.maximum(self.hi[0][0::2], self.hi[0][1::2]))
+
+
+    def triangle_distance2(self, triangle, points):
+
+        # Squared distance from points[k] to triangle[k]
+        d = closest_points_on_triangles(self.triangles[triangle], points) - points
+        return np.einsum('ij,ij->i', d, d)
+
+
+    def nearest(self, points, max_distance=np.inf, chunk=4096):
+
+        # points: query points, (n, 3)
+        # returns the nearest triangle of every point, -1 when none is within
+        # max_distance, and the distance to it. Ties go to the lowest triangle.
+        points = np.asarray(points, dtype=np.float64)
+        triangle = np.full(len(points), -1, dtype=np.intp)
+        distance = np.full(len(points), np.inf)
+        if len(points) == 0:
+            return triangle, distance
+
+        # Chunks of nearby points walk the same part of the tree
+        order = np.argsort(morton_codes(points), kind='stable')
+        for j0 in range(0, len(points), chunk):
+            rows = order[j0:j0 + chunk]
+            triangle[rows], distance[rows] = self.nearest_chunk(points[rows], max_distance)
+
+        return triangle, distance
+
+
+    def nearest_chunk(self, points, max_distance, k=2):
+
+        n = len(points)
+
+        # Upper bound: distance to the triangles of the k nearest centroids
+        k = min(k, len(self.triangles))
+        near = self.centroids.query(points, k=k)[1].reshape(n, k)
+        bound = self.triangle_distance2(near.ravel(), np.repeat(points, k, axis=0)).reshape(n, k).min(axis=1)
+        bound = np.minimum(bound, max_distance ** 2)
+        bound *= 1.0 + 1e-12        # rounding of the box and triangle distances
+
+        # All levels at once for all points: (point, node) pairs whose box is
+        # within the bound go down one level
+        point = np.arange(n)
+        node = np.zeros(n, dtype=np.intp)
+        for level in range(1, self.depth + 1):
+            point = np.repeat(point, 2)
+            node = 2 * np.repeat(node, 2) + np.tile([0, 1], len(node))
+            keep = box_distance2(self.lo[level][node], self.hi[level][node], points[point]) <= bound[point]
+            point = point[keep]
+            node = node[keep]
+
+        # Triangles of the leaves left, first by their own box
+        slot = (node[:, None] * self.leaf_size + np.arange(self.leaf_size)).ravel()
+        point = np.repeat(point, self.leaf_size)
+        keep = box_distance2(self.slot_lo[slot], self.slot_hi[slot], points[point]) <= bound[point]
+        point = point[keep]
+        triangle = self.slot_triangles[slot[keep]]
+
+        d2 = self.triangle_distance2(triangle, points[point])
+
+        # Nearest triangle of every point, the lowest one on ties. The pairs
+        # are still sorted by point.
+        keep = d2 <= max_distance ** 2
+        point, triangle, d2 = point[keep], triangle[keep], d2[keep]
+
+        nearest = np.full(n, -1, dtype=np.intp)
+        distance = np.full(n, np.inf)
+        if len(point) == 0:
+            return nearest, distance
+
+        start = np.flatnonzero(np.r_[True, point[1:] != point[:-1]])
+        count = np.diff(np.r_[start, len(point)])
+        d2min = np.minimum.reduceat(d2, start)
+        tie = np.where(d2 == np.repeat(d2min, count), triangle, len(self.triangles))
+
+        nearest[point[start]] = np.minimum.reduceat(tie, start)
+        distance[point[start]] = np.sqrt(d2min)
+
+        return nearest, distance
+
+
+def box_distance2(lo, hi, points):
+
+    # Squared distance from points to boxes, 0 inside, inf for empty boxes
+    d = np.maximum(np.maximum(lo - points, points - hi), 0.0)
+    return np.einsum('ij,ij->i', d, d)
+
+
+def morton_codes(points, bits=21):
+
+    # Z-order codes of points scaled to their bounding box, bits per axis
+    lo = points.min(axis=0)
+    span = np.maximum(points.max(axis=0) - lo, 1e-300)
+    q = ((points - lo) / span * (2 ** bits - 1)).astype(np.uint64)
+
+    codes = np.zeros(len(points), dtype=np.uint64)
+    for bit in range(bits):
+        for axis in range(3):
+            codes |= ((q[:, axis] >> np.uint64(bit)) & np.uint64(1)) << np.uint64(3 * bit + axis)
+
+    return codes
+
+
+def closest_points_on_triangles(triangles, points):
+
+    # triangles: (n, 3, 3), points: (n, 3), point k against triangle k
+    # Voronoi regions of the vertices, edges and face of each triangle, as in
+    # Ericson, Real-Time Collision Detection, 5.1.5
+    a, b, c = triangles[:, 0], triangles[:, 1], triangles[:, 2]
+    ab = b - a
+    ac = c - a
+
+    def dot(u, v):
+        return np.einsum('ij,ij->i', u, v)
+
+    ap = points - a
+    d1, d2 = dot(ab, ap), dot(ac, ap)
+    bp = points - b
+    d3, d4 = dot(ab, bp), dot(ac, bp)
+    cp = points - c
+    d5, d6 = dot(ab, cp), dot(ac, cp)
+
+    va = d3 * d6 - d5 * d4
+    vb = d5 * d2 - d1 * d6
+    vc = d1 * d4 - d3 * d2
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        # Face, then the regions in reverse order of precedence
+        denom = va + vb + vc
+        v = vb / denom
+        w = vc / denom
+
+        region = (va <= 0) & (d4 - d3 >= 0) & (d5 - d6 >= 0)        # edge bc
+        t = (d4 - d3) / ((d4 - d3) + (d5 - d6))
+        v = np.where(region, 1 - t, v)
+        w = np.where(region, t, w)
+
+        region = (vb <= 0) & (d2 >= 0) & (d6 <= 0)                  # edge ac
+        t = d2 / (d2 - d6)
+        v = np.where(region, 0, v)
+        w = np.where(region, t, w)
+
+        region = (d6 >= 0) & (d5 <= d6)                            # vertex c
+        v = np.where(region, 0, v)
+        w = np.where(region, 1, w)
+
+        region = (vc <= 0) & (d1 >= 0) & (d3 <= 0)                  # edge ab
+        t = d1 / (d1 - d3)
+        v = np.where(region, t, v)
+        w = np.where(region, 0, w)
+
+        region = (d3 >= 0) & (d4 <= d3)                            # vertex b
+        v = np.where(region, 1, v)
+        w = np.where(region, 0, w)
+
+        region = (d1 <= 0) & (d2 <= 0)                              # vertex a
+        v = np.where(region, 0, v)
+        w = np.where(region, 0, w)
+
+    # Degenerate triangles give nan, they are never the nearest
+    closest = a + v[:, None] * ab + w[:, None] * ac
+    closest[~np.isfinite(closest).all(axis=1)] = np.inf
+
+    return closest
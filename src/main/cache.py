@@ -0,0 +1,101 @@
+# -*- coding: utf-8 -*-
+import os
+import hashlib
+import numpy as np
+
+
+class MapCache:
+    # On-disk store of mapping results, one .npz file per key. The key is a
+    # hash of the mesh files and of the mapping parameters, so any change of
+    # geometry points to a new entry. Entries are touched when used and the
+    # least recently used ones are removed beyond max_entries / max_bytes.
+    version = "mapg-1"
+
+    def __init__(self, cache_dir, max_entries=16, max_bytes=1024 * 1024 ** 2):
+
+        self.cache_dir = cache_dir
+        self.max_entries = int(max_entries)
+        self.max_bytes = int(max_bytes)
+
+
+    def key(self, filepaths, **params):
+
+        digest = file_digest(filepaths, hashlib.sha256(self.version.encode()))
+
+        for name in sorted(params):
+            digest.update("{}={!r};".format(name, params[name]).encode())
+
+        return digest.hexdigest()
+
+
+    def path(self, key):
+        return os.path.join(self.cache_dir, key + ".npz")
+
+
+    def load(self, key):
+
+        filepath = self.path(key)
+
+        try:
+            with np.load(filepath) as data:
+                entry = {name: data[name] for name in data.files}
+        except (OSError, ValueError):
+            return None
+
+        try:
+            os.utime(filepath)      # Most recently used
+        except FileNotFoundError:   # evicted meanwhile by another process
+            pass
+
+        return entry
+
+
+    def save(self, key, **arrays):
+
+        os.makedirs(self.cache_dir, exist_ok=True)
+        filepath = self.path(key)
+
+        # Write then rename, so readers never see a partial entry
+        tmppath = "{}.{}.tmp".format(filepath, os.getpid())
+        with open(tmppath, 'wb') as file:
+            np.savez(file, **arrays)
+        os.replace(tmppath, filepath)
+
+        self.evict()
+
+
+    def evict(self):
+
+        entries = []
+        for name in os.listdir(self.cache_dir):
+            if name.endswith(".npz"):
+                try:
+                    stat = os.stat(os.path.join(self.cache_dir, name))
+                except FileNotFoundError:   # removed meanwhile by another process
+                    continue
+                entries.append((stat.st_mtime, stat.st_size, name))
+
+        entries.sort(reverse=True)
+
+        total = 0
+        for n, (mtime, size, name) in enumerate(entries):
+            total += size
+            if n >= self.max_entries or (total > self.max_bytes and n > 0):
+                try:
+                    os.remove(os.path.join(self.cache_dir, name))
+                except OSError:
+                    pass
+
+
+def file_digest(filepaths, digest=None):
+
+    # sha256 of the contents of filepaths, in order, added to digest if given
+    digest = digest or hashlib.sha256()
+
+    for filepath in filepaths:
+        with open(filepath, 'rb') as file:
+            for block in iter(lambda: file.read(1 << 20), b''):
+                digest.update(block)
+        digest.update(b'\0')
+
+    return digest
@@ -1,6 +1,7 @@
 # -*- coding: utf-8 -*-
 import yaml
 import os
+import copy
 
 class Config:
     def __init__(self, filename):
@@ -17,17 +18,69 @@ class Config:
         # Number of pressure files
         self.np = len(self.data['files'])
                         
-        self.name = self.data['component']['name']
-        self.i_grids_file = self.data['component']['input_grids']
-        self.i_elements_file = self.data['component']['input_elements']
-        self.o_grids_file = self.data['component']['output_grids']
-        self.o_elements_file = self.data['component']['output_elements']        
-        self.i_mesh_type = self.data['component']['input_mesh_type']
-        self.i_press_type = self.data['component']['input_press_type']
-        self.o_mesh_type = self.data['component']['output_mesh_type']
-        self.o_press_type = self.data['component']['output_press_type']        
-        self.data_dir = self.data['component']['data_dir']
-        self.plane = self.data['component']['plane']
-            
+        # components: one `component:` block or a `components:` list, the
+        # attributes below are the ones of the first component
+        self.components = self.data.get('components') or [self.data['component']]
+        self.results_dir = self.results
+        self.set_component(self.components[0])
+        
+        # run options (optional block)
+        self.run = self.data.get('run') or {}
+        self.mode = self.run.get('mode', 'serial')          # serial, batch, parallel, stream or pipeline
+        self.workers = int(self.run.get('workers', os.cpu_count() or 1))  # parallel mode processes
+        self.tol = float(self.run.get('tol', 1e-10))        # point in panel tolerance
+        self.sidecar = self.run.get('sidecar', True)        # .npy copies of the input tables
+        self.profile = self.run.get('profile', False)       # timers and run-report.json
+        self.vtk = self.run.get('vtk')                      # per case output mesh: vtk, vtk-ascii or vtu
+        self.output = self.run.get('output', 'text')        # text files, store or both
+        self.precision = self.run.get('precision', 'double')    # mesh arrays and pressures: double or single
+        self.chunk = int(self.run.get('chunk', 16))                 # stream mode: cases held at once
+        self.chunk_rows = int(self.run.get('chunk_rows', 100000))   # stream mode: pressure rows per block
+        self.prefetch = int(self.run.get('prefetch', 2))    # pipeline mode: cases queued for reading and writing
+        self.averaging = self.run.get('averaging', 'equal')     # pressures on grids to elements: equal or area weights
+        self.store_path = os.path.join(self.results, self.run.get('store', self.name + '.store'))
+        
+        # mapping cache, entries kept in cache_dir up to cache_entries / cache_size (MB)
+        self.cache = self.run.get('cache', True)
+        self.cache_dir = os.path.join(self.results, self.run.get('cache_dir', 'cache'))
+        self.cache_entries = int(self.run.get('cache_entries', 16))
+        self.cache_size = float(self.run.get('cache_size', 1024))
+        self.incremental = self.run.get('incremental', True)    # remap only the points of edited output panels
+        
+        # nearest panel in 3-D: off, fallback for the points outside every
+        # panel in the plane, or primary; no limit on the distance by default
+        self.nearest = self.run.get('nearest') or 'off'
+        self.max_distance = self.run.get('max_distance')
+        
         
+    def set_component(self, component):
         
+        self.name = component['name']
+        self.i_grids_file = component['input_grids']
+        self.i_elements_file = component['input_elements']
+        self.o_grids_file = component['output_grids']
+        self.o_elements_file = component['output_elements']
+        self.i_mesh_type = component['input_mesh_type']
+        self.i_press_type = component['input_press_type']
+        self.o_mesh_type = component['output_mesh_type']
+        self.o_press_type = component['output_press_type']
+        self.data_dir = component['data_dir']
+        self.plane = component['plane']
+        
+        
+    def component_configs(self):
+        
+        # One config per component, results of each in results/<name> when
+        # there are several. The `files:` cases are shared, each component
+        # reads them from its own data_dir.
+        configs = []
+        
+        for component in self.components:
+            conf = copy.copy(self)
+            conf.set_component(component)
+            if len(self.components) > 1:
+                conf.results_dir = os.path.join(self.results, conf.name)
+                conf.store_path = os.path.join(self.results, conf.name + '.store')
+            configs.append(conf)
+            
+        return configs
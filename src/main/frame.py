@@ -0,0 +1,77 @@
+# -*- coding: utf-8 -*-
+import os
+import numpy as np
+
+
+class Frame:
+    # Reference frame of cs.txt: reference point, coordinate system and
+    # reference geometries. Parsed once per file and shared by every mesh.
+    frames = {}
+
+    def __init__(self, cspath):
+
+        self.refpoint = np.zeros(3)
+        self.refcs = np.zeros((4, 3))
+
+        with open(cspath, 'r') as f1:
+            lines = f1.readlines()
+
+        self.refpoint[0:3] = list(map(float, lines[1].split()[0:3]))       # Reference Point
+        for i in range(4):
+            self.refcs[i, 0:3] = list(map(float, lines[3 + i].split()[0:3]))  # Reference Coordinate System
+        self.aref = float(lines[8].split()[0])                             # Reference Geometries
+        self.cref = float(lines[9].split()[0])
+        self.bref = float(lines[10].split()[0])
+
+        self.refcsvec = self.refcs[1:4, :] - self.refpoint      # Coordinate System Vectors
+
+
+    @classmethod
+    def load(cls, cspath):
+
+        key = (os.path.abspath(cspath), os.path.getmtime(cspath))
+
+        if key not in cls.frames:
+            cls.frames[key] = cls(cspath)
+
+        return cls.frames[key]
+
+
+    def integrate(self, forces, arms):
+
+        # forces: element forces, (n, 3) or (n, 3, ncases)
+        # arms: element centers relative to the reference point, (n, 3)
+        # returns force and moment coefficients, (3) or (3, ncases), and the
+        # resultant moment in the reference coordinate system
+
+        return self.coefficients(*self.resultants(forces, arms))
+
+
+    def resultants(self, forces, arms):
+
+        # Force and moment sums in global axes. Being sums, they can be
+        # accumulated over chunks of elements before calling coefficients.
+        if forces.ndim == 2:
+            moments = np.cross(forces, arms)                                    # Mx, My, Mz
+        else:
+            moments = np.cross(forces, arms[:, :, None], axisa=1, axisb=1, axisc=1)
+
+        # Sums in double precision for single precision meshes too
+        return forces.sum(axis=0, dtype=np.float64), moments.sum(axis=0, dtype=np.float64)
+
+
+    def coefficients(self, force_sum, moment_sum):
+
+        rotated_forces = np.tensordot(self.refcsvec, force_sum, axes=1)
+        rotated_moments = np.tensordot(self.refcsvec, moment_sum, axes=1)
+
+        integrated_forces = rotated_forces / self.aref
+
+        # Moment coefficients keep the definition of the result files, built
+        # on the rotated force sums
+        integrated_moments = np.empty_like(integrated_forces)
+        integrated_moments[0] = rotated_forces[0] / (self.aref * self.bref)
+        integrated_moments[1] = rotated_forces[1] / (self.aref * self.cref)
+        integrated_moments[2] = rotated_forces[2] / (self.aref * self.bref)
+
+        return integrated_forces, integrated_moments, rotated_moments
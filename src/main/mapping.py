@@ -0,0 +1,191 @@
+# -*- coding: utf-8 -*-
+import numpy as np
+
+
+class PanelIndex:
+    # Uniform bucket grid over the panel bounding boxes projected on the
+    # mapping plane (0: xy, 1: xz). Built once per output mesh, it returns for
+    # each query point the few panels whose box overlaps it, in ascending
+    # panel order so that the first containing panel wins as in a full scan.
+    def __init__(self, panel_grids, plane, max_cells=4096, pad=None):
+
+        self.g1, self.g2 = 0, 1  # Default values for plane xy
+
+        if int(plane) == 1:  # Adjust values for plane xz
+            self.g2 = 2
+
+        grids = panel_grids[:, :, [self.g1, self.g2]]
+        self.npanels = grids.shape[0]
+
+        self.lo = grids.min(axis=1)
+        self.hi = grids.max(axis=1)
+
+        # Small padding so points lying on a panel edge are not lost
+        self.pad = self.padding(panel_grids, plane) if pad is None else pad
+        self.lo -= self.pad
+        self.hi += self.pad
+
+        self.origin = self.lo.min(axis=0)
+        span = self.hi.max(axis=0) - self.origin
+
+        # Cell size close to the mean panel size, bounded in number of cells
+        size = np.maximum((self.hi - self.lo).mean(axis=0), span / max_cells)
+        size[size <= 0] = 1.0
+        self.size = size
+        self.ncells = np.maximum(np.ceil(span / size).astype(np.intp), 1)
+
+        i0 = self.cell_coords(self.lo)
+        i1 = self.cell_coords(self.hi)
+
+        # Expand every panel into the cells covered by its bounding box
+        nx = i1[:, 0] - i0[:, 0] + 1
+        ny = i1[:, 1] - i0[:, 1] + 1
+        counts = nx * ny
+        panel = np.repeat(np.arange(self.npanels), counts)
+        offset = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)
+        cx = i0[panel, 0] + offset % nx[panel]
+        cy = i0[panel, 1] + offset // nx[panel]
+        cell = cx * self.ncells[1] + cy
+
+        # Cell -> panels table in CSR layout, panels sorted inside each cell
+        order = np.lexsort((panel, cell))
+        self.cell_panels = panel[order]
+        self.cell_start = np.zeros(self.ncells[0] * self.ncells[1] + 1, dtype=np.intp)
+        np.add.at(self.cell_start, cell + 1, 1)
+        np.cumsum(self.cell_start, out=self.cell_start)
+
+
+    @staticmethod
+    def padding(panel_grids, plane):
+
+        g2 = 2 if int(plane) == 1 else 1
+        grids = panel_grids[:, :, [0, g2]]
+        lo = grids.min(axis=1)
+        hi = grids.max(axis=1)
+        extent = max(np.ptp(lo, axis=0).max(), np.ptp(hi, axis=0).max(), 1.0)
+        return 1e-8 * extent
+
+
+    def cell_coords(self, xy):
+        ij = np.floor((xy - self.origin) / self.size).astype(np.intp)
+        return np.clip(ij, 0, self.ncells - 1)
+
+
+    def candidates(self, points):
+
+        # points: query points, (npi, 3)
+        # returns (point, panel) candidate pairs, sorted by point and then
+        # by ascending panel
+
+        xy = points[:, [self.g1, self.g2]]
+        ij = self.cell_coords(xy)
+        cell = ij[:, 0] * self.ncells[1] + ij[:, 1]
+
+        start = self.cell_start[cell]
+        counts = self.cell_start[cell + 1] - start
+        point = np.repeat(np.arange(len(xy)), counts)
+        offset = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)
+        cand = self.cell_panels[np.repeat(start, counts) + offset]
+
+        # Keep only panels whose bounding box really contains the point
+        keep = np.all((xy[point] >= self.lo[cand]) & (xy[point] <= self.hi[cand]), axis=1)
+
+        return point[keep], cand[keep]
+
+
+# Sub-triangles tested for each panel type. The union of the four corner
+# triangles of a quad is the convex hull of its nodes, which is the region
+# a Delaunay triangulation of the panel covers.
+PANEL_TRIANGLES = {3: np.array([[0, 1, 2]]),
+                   4: np.array([[0, 1, 2], [0, 2, 3], [0, 1, 3], [1, 2, 3]])}
+
+
+def points_inside_panels(panel_grids, points, plane, tol=1e-10):
+
+    # panel_grids: panel node coordinates, (n, 3 or 4, 3)
+    # points: query points, (n, 3), point k is tested against panel k
+    # A point is inside when all its barycentric coordinates in one of the
+    # panel triangles are >= -tol (same criterion as Delaunay.find_simplex)
+
+    g1, g2 = 0, 1  # Default values for plane xy
+
+    if int(plane) == 1:  # Adjust values for plane xz
+        g2 = 2
+
+    px = points[:, g1]
+    py = points[:, g2]
+    inside = np.zeros(len(points), dtype=bool)
+
+    for a, b, c in PANEL_TRIANGLES[panel_grids.shape[1]]:
+        ax, ay = panel_grids[:, a, g1], panel_grids[:, a, g2]
+        v0x, v0y = panel_grids[:, b, g1] - ax, panel_grids[:, b, g2] - ay
+        v1x, v1y = panel_grids[:, c, g1] - ax, panel_grids[:, c, g2] - ay
+        v2x, v2y = px - ax, py - ay
+
+        with np.errstate(divide='ignore', invalid='ignore'):
+            det = v0x * v1y - v0y * v1x
+            l1 = (v2x * v1y - v2y * v1x) / det
+            l2 = (v0x * v2y - v0y * v2x) / det
+
+            # Degenerate triangles give nan and never match
+            inside |= (l1 >= -tol) & (l2 >= -tol) & (1.0 - l1 - l2 >= -tol)
+
+    return inside
+
+
+def shape_weights(panel_grids, points, plane, nnodes=None, iterations=8):
+
+    # panel_grids: panel node coordinates, (n, 3 or 4, 3)
+    # points: points in the panels, (n, 3), point k in panel k
+    # nnodes: nodes of every panel, 3 for the triangles of a quad mesh
+    # Weights of the panel nodes at the points in the mapping plane:
+    # barycentric coordinates for triangles, inverse bilinear coordinates for
+    # quads. Points outside their panel are brought back onto its boundary,
+    # so weights are >= 0 and sum to 1.
+
+    g = [0, 2] if int(plane) == 1 else [0, 1]
+    nodes = panel_grids[:, :, g].astype(np.float64, copy=False)
+    p = points[:, g].astype(np.float64, copy=False)
+
+    n, width = panel_grids.shape[0], panel_grids.shape[1]
+    weights = np.zeros((n, width))
+    tri = np.full(n, width == 3) if nnodes is None else (np.asarray(nnodes) == 3)
+
+    # Triangles
+    a, b, c = nodes[tri, 0], nodes[tri, 1], nodes[tri, 2]
+    v0, v1, v2 = b - a, c - a, p[tri] - a
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        det = v0[:, 0] * v1[:, 1] - v0[:, 1] * v1[:, 0]
+        l1 = (v2[:, 0] * v1[:, 1] - v2[:, 1] * v1[:, 0]) / det
+        l2 = (v0[:, 0] * v2[:, 1] - v0[:, 1] * v2[:, 0]) / det
+
+    w = np.maximum(np.column_stack((1.0 - l1 - l2, l1, l2)), 0.0)
+    w = np.where(np.isfinite(w).all(axis=1)[:, None], w, 1.0)     # degenerate in the plane: equal shares
+    weights[tri, 0:3] = w / w.sum(axis=1)[:, None]
+
+    # Quads: x(u, v) = (1-u)(1-v) x0 + u(1-v) x1 + uv x2 + (1-u)v x3 solved
+    # for (u, v) by Newton iterations, then clipped to [0, 1]
+    quad = ~tri
+    if np.any(quad):
+        x0, x1, x2, x3 = (nodes[quad, k] for k in range(4))
+        q = p[quad]
+        u = np.full(len(q), 0.5)
+        v = np.full(len(q), 0.5)
+
+        with np.errstate(divide='ignore', invalid='ignore'):
+            for _ in range(iterations):
+                r = ((1 - u) * (1 - v))[:, None] * x0 + (u * (1 - v))[:, None] * x1 + (u * v)[:, None] * x2 \
+                    + ((1 - u) * v)[:, None] * x3 - q
+                du = (1 - v)[:, None] * (x1 - x0) + v[:, None] * (x2 - x3)
+                dv = (1 - u)[:, None] * (x3 - x0) + u[:, None] * (x2 - x1)
+                det = du[:, 0] * dv[:, 1] - du[:, 1] * dv[:, 0]
+                u = u - (r[:, 0] * dv[:, 1] - r[:, 1] * dv[:, 0]) / det
+                v = v - (du[:, 0] * r[:, 1] - du[:, 1] * r[:, 0]) / det
+
+        # Degenerate quads in the plane: center of the panel
+        u = np.clip(np.nan_to_num(u, nan=0.5), 0.0, 1.0)
+        v = np.clip(np.nan_to_num(v, nan=0.5), 0.0, 1.0)
+        weights[quad] = np.column_stack(((1 - u) * (1 - v), u * (1 - v), u * v, (1 - u) * v))
+
+    return weights
@@ -0,0 +1,103 @@
+# -*- coding: utf-8 -*-
+import os
+import sys
+import json
+import time
+import contextlib
+
+try:
+    import resource
+except ImportError:     # not available on Windows
+    resource = None
+
+
+class Profiler:
+    # Stage timers (wall and CPU), counters, peak memory and a throttled
+    # progress reporter. Disabled, every call returns at once.
+    def __init__(self, enabled=False, interval=2.0, stream=None):
+
+        self.enabled = bool(enabled)
+        self.interval = float(interval)        # seconds between progress lines
+        self.stream = stream or sys.stdout
+        self.stages = {}
+        self.counters = {}
+        self.last_progress = {}
+        self.start = time.perf_counter()
+
+
+    @classmethod
+    def from_env(cls, enabled=False):
+
+        # PROJECT_MESH_PROFILE=1 turns it on, =0 off, whatever the config says
+        env = os.environ.get("PROJECT_MESH_PROFILE")
+        if env is not None:
+            enabled = env.strip().lower() not in ("", "0", "false", "no", "off")
+
+        return cls(enabled)
+
+
+    @contextlib.contextmanager
+    def stage(self, name):
+
+        if not self.enabled:
+            yield
+            return
+
+        wall = time.perf_counter()
+        cpu = time.process_time()
+        try:
+            yield
+        finally:
+            stage = self.stages.setdefault(name, {"calls": 0, "wall": 0.0, "cpu": 0.0})
+            stage["calls"] += 1
+            stage["wall"] += time.perf_counter() - wall
+            stage["cpu"] += time.process_time() - cpu
+
+
+    def count(self, name, n=1):
+
+        if self.enabled:
+            self.counters[name] = self.counters.get(name, 0) + int(n)
+
+
+    def progress(self, label, done, total):
+
+        if not self.enabled:
+            return
+
+        now = time.perf_counter()
+        if done < total and now - self.last_progress.get(label, 0.0) < self.interval:
+            return
+
+        self.last_progress[label] = now
+        self.stream.write("{}: {}/{}\n".format(label, done, total))
+        self.stream.flush()
+
+
+    def peak_memory(self):
+
+        # Peak resident set size in bytes
+        if resource is None:
+            return None
+
+        rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return rss if sys.platform == "darwin" else rss * 1024
+
+
+    def report(self):
+
+        return {"wall": time.perf_counter() - self.start,
+                "cpu": time.process_time(),
+                "peak_memory": self.peak_memory(),
+                "stages": self.stages,
+                "counters": self.counters}
+
+
+    def write(self, filepath):
+
+        if not self.enabled:
+            return
+
+        with open(filepath, 'w') as file:
+            json.dump(self.report(), file, indent=2)
+            file.write("\n")
@@ -0,0 +1,703 @@
+# -*- coding: utf-8 -*-
+import os
+import queue
+import threading
+import multiprocessing
+import numpy as np
+from scipy.sparse import diags
+from surface import Surface
+from cache import MapCache, file_digest
+from profiler import Profiler
+from store import ResultStore
+from textio import table_width, iter_table
+
+
+class Runner:
+    def __init__(self, conf):
+        
+        self.conf = conf
+        self.imesh = Surface(conf.i_mesh_type)
+        self.omesh = Surface(conf.o_mesh_type)
+        self.imesh.sidecar = conf.sidecar
+        self.omesh.sidecar = conf.sidecar
+        self.imesh.dtype = self.omesh.dtype = np.float32 if conf.precision == "single" else np.float64
+        self.imesh.results_dir = conf.results_dir
+        self.omesh.results_dir = conf.results_dir
+        os.makedirs(conf.results_dir, exist_ok=True)
+        
+        self.profiler = Profiler.from_env(conf.profile)
+        self.imesh.profiler = self.profiler
+        self.omesh.profiler = self.profiler
+        
+        self.text = conf.output in ("text", "both")      # forces_<i>*.txt files
+        self.store = None
+        self.coefficients = {}      # case name -> input then output CF/CM
+        
+        
+    def setup(self):
+        
+        conf = self.conf
+        imesh = self.imesh
+        omesh = self.omesh
+        
+        profiler = self.profiler
+        
+        # Input mesh reading
+        with profiler.stage("read_input_mesh"):
+            imesh.read_grids(conf.data_dir, conf.i_grids_file)
+            imesh.read_elements(conf.data_dir, conf.i_elements_file)
+            imesh.calc_area()
+            imesh.allocate_press(conf.np)
+            if (int(conf.i_press_type) == 0):   # pressure on grids
+                imesh.build_averaging(conf.averaging == 'area')
+        
+        # Output mesh reading
+        with profiler.stage("read_output_mesh"):
+            omesh.read_grids(conf.data_dir, conf.o_grids_file)
+            omesh.read_elements(conf.data_dir, conf.o_elements_file)
+        with profiler.stage("mapgrids"):
+            self.mapgrids()
+            if (int(conf.o_press_type) == 0):   # forces on the output grids too
+                omesh.build_nodal(imesh.centers, conf.plane)
+        with profiler.stage("read_output_mesh"):
+            omesh.calc_area()
+        
+        
+    def open_store(self, names):
+        
+        # Existing store of the same output mesh: cases are added or replaced.
+        # The store of another mesh is never overwritten.
+        conf = self.conf
+        
+        if conf.output not in ("store", "both"):
+            return
+        
+        mesh = file_digest([os.path.join(self.omesh.resources_dir, conf.data_dir, name)
+                            for name in (conf.o_grids_file, conf.o_elements_file)]).hexdigest()
+        
+        if self.store is None and os.path.exists(os.path.join(conf.store_path, "index.json")):
+            store = ResultStore(conf.store_path, 'r+')
+            if store.mesh != mesh:
+                raise ValueError("{} holds the results of another output mesh: remove it or "
+                                 "change run: store".format(conf.store_path))
+            self.store = store
+                
+        if self.store is None:
+            self.store = ResultStore.create(conf.store_path, self.omesh.nelements, len(names), mesh)
+            
+        # Rows are fixed before any case runs, workers write their own rows
+        self.case_rows = [self.store.row(name) for name in names]
+        if max(self.case_rows, default=-1) >= self.store.capacity:
+            self.store.grow(max(self.case_rows) + 1)
+            
+            
+    def mapgrids(self):
+        
+        conf = self.conf
+        imesh = self.imesh
+        omesh = self.omesh
+        
+        cache = None
+        key = None
+        last_key = None
+        
+        if conf.cache:
+            cache = MapCache(conf.cache_dir, conf.cache_entries, conf.cache_size * 1024 ** 2)
+            files = [os.path.join(imesh.resources_dir, conf.data_dir, name) for name in
+                     (conf.i_grids_file, conf.i_elements_file, conf.o_grids_file, conf.o_elements_file)]
+            params = dict(plane=int(conf.plane), tol=conf.tol, i_mesh_type=imesh.mesh_type, o_mesh_type=omesh.mesh_type,
+                          precision=conf.precision)
+            if conf.nearest != 'off':
+                params.update(nearest=conf.nearest, max_distance=conf.max_distance)
+            key = cache.key(files, **params)
+            
+            # Last mapping of this input mesh, to remap only what an edit of
+            # the output mesh changed
+            if conf.incremental and conf.nearest == 'off':
+                last_key = cache.key(files[0:2], last=conf.name, **params)
+                
+        omesh.mapgrids(imesh.centers, imesh.nelements, conf.plane, tol=conf.tol, cache=cache, key=key, last_key=last_key,
+                       nearest=conf.nearest, max_distance=conf.max_distance)
+        
+        
+    def run(self):
+        
+        conf = self.conf
+        
+        if conf.mode == "batch":
+            self.run_batch()
+        elif conf.mode == "parallel":
+            self.run_parallel(conf.workers)
+        elif conf.mode == "stream":
+            self.run_stream()
+        elif conf.mode == "pipeline":
+            self.run_pipeline()
+        else:
+            self.run_serial()
+            
+            
+    def case_names(self):
+        
+        # Cases in the order of the run, stream mode splits multi-column files
+        if self.conf.mode == "stream":
+            return [name for name, _, _ in self.stream_cases()]
+        
+        return list(self.conf.data['files'])
+    
+    
+    def run_serial(self):
+        
+        self.open_store(self.conf.data['files'])
+        
+        for i in range(self.conf.np):
+            self.run_case(i)
+            if self.store is not None:
+                self.store.checkpoint()
+            
+            
+    def run_case(self, i):
+        
+        conf = self.conf
+        imesh = self.imesh
+        omesh = self.omesh
+        profiler = self.profiler
+        
+        # Input pressures reading
+        with profiler.stage("read_press"):
+            imesh.read_press(conf.data_dir, conf.data['files'][i], conf.i_press_type)
+        
+        with profiler.stage("projectmesh"):
+            if (conf.i_press_type == 1):    # pressure on elements
+                omesh.projectmesh(imesh.centers, imesh.area, imesh.press, conf.plane)
+            elif (conf.i_press_type == 0):   # pressure on grids
+                imesh.pressure_on_elements_centers()
+                omesh.projectmesh(imesh.centers, imesh.area, imesh.pressures_on_centers, conf.plane)
+            
+        with profiler.stage("write_projected_mesh"):
+            fout = "forces_" + str(i + 1) + ".txt"
+            if self.text:
+                omesh.write_projected_mesh(fout)
+                if omesh.nodal is not None:
+                    omesh.write_nodal(fout.replace(".txt", "_nodal.txt"), omesh.nforce)
+            else:
+                omesh.intmesh2(None)
+            if conf.vtk:
+                omesh.write_mesh(fout, cell_data={"pcenter": omesh.pcenter, "cforce": omesh.cforce, "area": omesh.area[:, 0:3]}, fmt=conf.vtk)
+        
+        with profiler.stage("intmesh"):
+            fout = "forces_" + str(i + 1) + "_input_int.txt"
+            imesh.intmesh(fout if self.text else None)
+            
+        coefficients = np.concatenate((imesh.integrated_forces, imesh.integrated_moments,
+                                       omesh.integrated_forces, omesh.integrated_moments), axis=0)
+        self.coefficients[conf.data['files'][i]] = coefficients
+        
+        if self.store is not None:
+            with profiler.stage("store"):
+                self.store.write(self.case_rows[i], conf.data['files'][i], omesh.cforce, omesh.pcenter, coefficients)
+            
+        profiler.count("cases")
+        profiler.progress("cases", i + 1, conf.np)
+        
+        return coefficients
+        
+        
+    def run_parallel(self, workers):
+        
+        # Worker processes are forked after setup: meshes, mapping and transfer
+        # operator are inherited, only case numbers are sent to them
+        if "fork" not in multiprocessing.get_all_start_methods() or self.conf.np == 0:
+            return self.run_serial()
+        
+        self.open_store(self.conf.data['files'])
+        
+        # Reference frame and moment arms too
+        self.imesh.moment_arms()
+        self.omesh.moment_arms()
+        
+        global active_runner
+        active_runner = self
+        
+        workers = min(int(workers), self.conf.np)
+        chunksize = max(1, self.conf.np // (4 * workers))
+        
+        # Per-stage timers of the workers stay in the workers
+        try:
+            with self.profiler.stage("cases"), multiprocessing.get_context("fork").Pool(workers) as pool:
+                for done, (i, coefficients) in enumerate(pool.imap_unordered(run_case, range(self.conf.np), chunksize)):
+                    self.coefficients[self.conf.data['files'][i]] = coefficients
+                    if self.store is not None:      # row written by the worker
+                        self.store.commit(self.conf.data['files'][i], self.case_rows[i])
+                        self.store.checkpoint()
+                    self.profiler.progress("cases", done + 1, self.conf.np)
+        finally:
+            active_runner = None
+            
+        self.profiler.count("cases", self.conf.np)
+        
+        
+    def run_batch(self):
+        
+        conf = self.conf
+        imesh = self.imesh
+        omesh = self.omesh
+        
+        profiler = self.profiler
+        
+        self.open_store(conf.data['files'])
+        
+        # All pressure files as one (npi, ncases) array
+        with profiler.stage("read_press"):
+            imesh.read_press_batch(conf.data_dir, conf.data['files'], conf.i_press_type)
+        
+        if (conf.i_press_type == 1):    # pressure on elements
+            press = imesh.press
+        elif (conf.i_press_type == 0):   # pressure on grids
+            imesh.pressure_on_elements_centers()
+            press = imesh.pressures_on_centers
+            
+        with profiler.stage("projectmesh"):
+            omesh.projectmesh(imesh.centers, imesh.area, press, conf.plane)
+        
+        with profiler.stage("intmesh"):
+            imesh.intmesh(None)
+            omesh.intmesh2(None)
+        iforces, imoments = imesh.integrated_forces, imesh.integrated_moments
+        oforces, omoments = omesh.integrated_forces, omesh.integrated_moments
+        
+        with profiler.stage("write_projected_mesh"):
+            for i in range(conf.np):
+                self.write_case(i, conf.data['files'][i], omesh.cforce[:, :, i], omesh.pcenter[:, i],
+                                iforces[:, i], imoments[:, i], oforces[:, i], omoments[:, i],
+                                None if omesh.nforce is None else omesh.nforce[:, :, i])
+                
+            self.write_table("coefficients.txt", conf.data['files'], iforces, imoments, oforces, omoments)
+            
+        profiler.count("cases", conf.np)
+        
+        
+    def write_case(self, i, name, cforce, pcenter, iforces, imoments, oforces, omoments, nforce=None):
+        
+        # Results of case i from explicit arrays, the meshes are only read.
+        # nforce: nodal forces on the output grids, if any
+        conf = self.conf
+        omesh = self.omesh
+        fout = "forces_" + str(i + 1) + ".txt"
+        
+        self.coefficients[name] = np.concatenate((iforces, imoments, oforces, omoments))
+        
+        if self.text:
+            omesh.write_forces(fout, cforce)
+            omesh.write_coefficients(fout.replace(".txt", "_output_int.txt"), oforces, omoments)
+            self.imesh.write_coefficients(fout.replace(".txt", "_input_int.txt"), iforces, imoments)
+            if nforce is not None:
+                omesh.write_nodal(fout.replace(".txt", "_nodal.txt"), nforce)
+            
+        if self.store is not None:
+            self.store.write(self.case_rows[i], name, cforce, pcenter, self.coefficients[name])
+            
+        if conf.vtk:
+            omesh.write_mesh(fout, cell_data={"pcenter": pcenter, "cforce": cforce, "area": omesh.area[:, 0:3]}, fmt=conf.vtk)
+            
+            
+    def project_case(self, press):
+        
+        # One case from its pressures, without any file written. Returns
+        # cforce, pcenter, the input and output force / moment coefficients
+        # and the nodal forces (None without nodal output).
+        conf = self.conf
+        imesh = self.imesh
+        omesh = self.omesh
+        profiler = self.profiler
+        
+        imesh.press = press
+        
+        with profiler.stage("projectmesh"):
+            if (conf.i_press_type == 1):    # pressure on elements
+                omesh.projectmesh(imesh.centers, imesh.area, imesh.press, conf.plane)
+            elif (conf.i_press_type == 0):   # pressure on grids
+                imesh.pressure_on_elements_centers()
+                omesh.projectmesh(imesh.centers, imesh.area, imesh.pressures_on_centers, conf.plane)
+                
+        with profiler.stage("intmesh"):
+            imesh.intmesh(None)
+            omesh.intmesh2(None)
+            
+        return (omesh.cforce, omesh.pcenter, imesh.integrated_forces, imesh.integrated_moments,
+                omesh.integrated_forces, omesh.integrated_moments, omesh.nforce)
+        
+        
+    def run_pipeline(self):
+        
+        # Serial cases with the I/O overlapped: a reader thread loads the
+        # pressures of the next cases and a writer thread writes the results of
+        # the previous ones while the main thread projects and integrates. Both
+        # queues hold at most `prefetch` cases, so memory stays bounded.
+        conf = self.conf
+        imesh = self.imesh
+        omesh = self.omesh
+        profiler = self.profiler
+        
+        names = conf.data['files']
+        self.open_store(names)
+        
+        # Reference frame and moment arms before the threads start
+        imesh.moment_arms()
+        omesh.moment_arms()
+        
+        size = max(int(conf.prefetch), 1)
+        pressures = queue.Queue(size)
+        results = queue.Queue(size)
+        stop = threading.Event()
+        errors = []
+        
+        def put(q, item):
+            # False once the pipeline is stopped, a full queue never blocks it
+            while not stop.is_set():
+                try:
+                    q.put(item, timeout=0.1)
+                    return True
+                except queue.Full:
+                    pass
+            return False
+        
+        def reader():
+            try:
+                for i, name in enumerate(names):
+                    filepath = os.path.join(imesh.resources_dir, conf.data_dir, name)
+                    if not put(pressures, (i, imesh.load_press(filepath, conf.i_press_type))):
+                        return
+            except Exception as error:
+                errors.append(error)
+            put(pressures, None)
+            
+        def writer():
+            while True:
+                item = results.get()
+                if item is None:
+                    return
+                if errors:
+                    continue        # keep draining, the main thread stops
+                try:
+                    i, cforce, pcenter, iforces, imoments, oforces, omoments, nforce = item
+                    self.write_case(i, names[i], cforce, pcenter, iforces, imoments, oforces, omoments, nforce)
+                    self.write_table("coefficients.txt", [names[i]], iforces[:, None], imoments[:, None],
+                                     oforces[:, None], omoments[:, None], mode='a')
+                    if self.store is not None:
+                        self.store.checkpoint()
+                except Exception as error:
+                    errors.append(error)
+                    stop.set()
+                    
+        empty = np.empty((3, 0))
+        self.write_table("coefficients.txt", [], empty, empty, empty, empty)
+        
+        threads = [threading.Thread(target=reader, name="press-reader", daemon=True),
+                   threading.Thread(target=writer, name="result-writer", daemon=True)]
+        for thread in threads:
+            thread.start()
+            
+        try:
+            while not errors:
+                with profiler.stage("read_press"):      # time spent waiting for the reader
+                    item = pressures.get()
+                if item is None:
+                    break
+                i, press = item
+                
+                # Arrays of a case are new at every projection, the writer owns them
+                result = self.project_case(press)
+                with profiler.stage("write_projected_mesh"):    # time spent waiting for the writer
+                    put(results, (i,) + result)
+                    
+                profiler.count("cases")
+                profiler.progress("cases", i + 1, conf.np)
+        finally:
+            stop.set()          # releases a reader still waiting on a full queue
+            results.put(None)
+            for thread in threads:
+                thread.join()
+                
+        if errors:
+            raise errors[0]
+            
+            
+    def stream_cases(self):
+        
+        # (file, column) of every case: a file with several pressure columns
+        # after the id holds one case per column
+        conf = self.conf
+        cases = []
+        
+        for filename in conf.data['files']:
+            filepath = os.path.join(self.imesh.resources_dir, conf.data_dir, filename)
+            ncolumns = table_width(filepath, self.imesh.sidecar) - 1
+            for k in range(ncolumns):
+                name = filename if ncolumns == 1 else "{}:{:d}".format(filename, k + 1)
+                cases.append((name, filepath, k + 1))
+                
+        return cases
+    
+    
+    def press_blocks(self, group):
+        
+        # Generator of (rows, pressures) blocks for a group of cases, at most
+        # chunk_rows rows of the group's columns at a time. Rows are elements,
+        # or grids for pressures on grids.
+        conf = self.conf
+        imesh = self.imesh
+        on_grids = int(conf.i_press_type) == 0
+        npi = imesh.ngrids if on_grids else imesh.nelements
+        files = sorted(set(filepath for _, filepath, _ in group))
+        readers = [iter_table(filepath, conf.chunk_rows, npi, imesh.sidecar) for filepath in files]
+        
+        # Every file has npi rows: a reader raises once it finds fewer or more,
+        # so all of them are read to their end
+        r0 = 0
+        for blocks in zip(*readers):
+            tables = dict(zip(files, blocks))
+            expected = imesh.ids[r0:r0 + len(blocks[0])] if on_grids else np.arange(r0 + 1, r0 + len(blocks[0]) + 1)
+            for filepath, table in tables.items():
+                if not np.array_equal(table[:, 0], expected):
+                    raise ValueError("{}: stream mode needs the pressure rows in {} order".format(
+                        filepath, "grid" if on_grids else "element"))
+            press = np.column_stack([tables[filepath][:, column] for _, filepath, column in group])
+            yield slice(r0, r0 + len(press)), press
+            r0 += len(press)
+            
+        for reader in readers:
+            next(reader, None)
+            
+            
+    def run_stream(self):
+        
+        # Out-of-core mode: groups of `chunk` cases flow through projection and
+        # integration by blocks of `chunk_rows` input elements, memory is bounded
+        # by chunk x chunk_rows and results are written group by group
+        conf = self.conf
+        imesh = self.imesh
+        omesh = self.omesh
+        profiler = self.profiler
+        
+        cases = self.stream_cases()
+        transfer = omesh.transfer.tocsc()       # column blocks of input elements
+        nodal = None if omesh.nodal is None else omesh.nodal.tocsc()
+        
+        # Pressures on grids: the averaging is folded into per-grid operators,
+        # so blocks of grid rows project and integrate on their own
+        if (int(conf.i_press_type) == 0):
+            imesh.moment_arms()
+            area = imesh.area[:, 0:3]
+            grid_transfer = (omesh.transfer @ imesh.averaging).tocsc()
+            grid_force_transfer = [(omesh.transfer @ diags(area[:, c]) @ imesh.averaging).tocsc() for c in range(3)]
+            grid_force = imesh.averaging.T @ area
+            grid_moment = imesh.averaging.T @ np.cross(area, imesh.arms)
+            if nodal is not None:
+                grid_nodal = [(omesh.nodal @ diags(area[:, c]) @ imesh.averaging).tocsc() for c in range(3)]
+        
+        self.open_store([name for name, _, _ in cases])
+        
+        empty = np.empty((3, 0))
+        self.write_table("coefficients.txt", [], empty, empty, empty, empty)
+        
+        for g0 in range(0, len(cases), max(conf.chunk, 1)):
+            group = cases[g0:g0 + max(conf.chunk, 1)]
+            ncases = len(group)
+            
+            pcenter = np.zeros((omesh.nelements, ncases))
+            cforce = np.zeros((omesh.nelements, 3 * ncases))
+            force_sum = np.zeros((3, ncases))
+            moment_sum = np.zeros((3, ncases))
+            nforce = None if nodal is None else np.zeros((omesh.ngrids, 3 * ncases))
+            
+            blocks = self.press_blocks(group)
+            while True:
+                with profiler.stage("read_press"):
+                    rows, press = next(blocks, (None, None))
+                if rows is None:
+                    break
+                    
+                if (int(conf.i_press_type) == 0):   # rows are grids
+                    with profiler.stage("projectmesh"):
+                        pcenter += grid_transfer[:, rows] @ press
+                        for c in range(3):
+                            cforce[:, c * ncases:(c + 1) * ncases] += grid_force_transfer[c][:, rows] @ press
+                            if nodal is not None:
+                                nforce[:, c * ncases:(c + 1) * ncases] += grid_nodal[c][:, rows] @ press
+                            
+                    with profiler.stage("intmesh"):
+                        force_sum += grid_force[rows].T @ press
+                        moment_sum += grid_moment[rows].T @ press
+                    continue
+                    
+                with profiler.stage("projectmesh"):
+                    forces = press[:, None, :] * imesh.area[rows, 0:3, None]
+                    pcenter += transfer[:, rows] @ press
+                    cforce += transfer[:, rows] @ forces.reshape(len(press), 3 * ncases)
+                    if nodal is not None:
+                        nforce += nodal[:, rows] @ forces.reshape(len(press), 3 * ncases)
+                    
+                with profiler.stage("intmesh"):
+                    fsum, msum = imesh.integrate_partial(forces, rows)
+                    force_sum += fsum
+                    moment_sum += msum
+                    
+            with profiler.stage("intmesh"):
+                omesh.pcenter = pcenter
+                omesh.cforce = cforce.reshape(omesh.nelements, 3, ncases)
+                if nodal is not None:
+                    omesh.nforce = nforce.reshape(omesh.ngrids, 3, ncases)
+                iforces, imoments = imesh.integrate_sums(force_sum, moment_sum)
+                omesh.intmesh2(None)
+                oforces, omoments = omesh.integrated_forces, omesh.integrated_moments
+                
+            with profiler.stage("write_projected_mesh"):
+                for k in range(ncases):
+                    self.write_case(g0 + k, group[k][0], omesh.cforce[:, :, k], pcenter[:, k],
+                                    iforces[:, k], imoments[:, k], oforces[:, k], omoments[:, k],
+                                    None if nodal is None else omesh.nforce[:, :, k])
+                        
+                self.write_table("coefficients.txt", [name for name, _, _ in group], iforces, imoments, oforces, omoments, mode='a')
+                if self.store is not None:
+                    self.store.flush()
+                
+            profiler.count("cases", ncases)
+            profiler.progress("cases", g0 + ncases, len(cases))
+            
+            
+    def finish(self):
+        
+        if self.store is not None:
+            self.store.flush()
+            
+        # Run report next to map-log.txt
+        self.profiler.write(os.path.join(self.omesh.results_dir, "run-report.json"))
+        
+        
+    def write_table(self, fout, cases, iforces, imoments, oforces, omoments, mode='w'):
+        
+        # One row per load case: input mesh and output mesh coefficients,
+        # mode 'a' adds rows to an existing table
+        filepath = os.path.join(self.omesh.results_dir, fout)
+        table = np.vstack((iforces, imoments, oforces, omoments)).T
+        
+        with open(filepath, mode) as file:
+            if mode == 'w':
+                file.write("{:>20s}".format("case") + "".join("{:>13s}".format(name) for name in
+                           ["iCFx", "iCFy", "iCFz", "iCMx", "iCMy", "iCMz", "oCFx", "oCFy", "oCFz", "oCMx", "oCMy", "oCMz"]) + "\n")
+            for case, row in zip(cases, table):
+                file.write("{:>20s}".format(case) + "".join(" {:12.6f}".format(value) for value in row) + "\n")
+
+
+class MultiRunner:
+    # Several components of one config in one run. Each component has its own
+    # Runner and results directory, parallel mode schedules every component x
+    # case task on one shared pool.
+    def __init__(self, conf):
+        
+        self.conf = conf
+        self.runners = [Runner(component) for component in conf.component_configs()]
+        
+        # One profiler and one run report for the whole run
+        self.profiler = Profiler.from_env(conf.profile)
+        for runner in self.runners:
+            runner.profiler = runner.imesh.profiler = runner.omesh.profiler = self.profiler
+            
+            
+    def setup(self):
+        
+        for runner in self.runners:
+            runner.setup()
+            
+            
+    def run(self):
+        
+        if self.conf.mode == "parallel" and "fork" in multiprocessing.get_all_start_methods():
+            self.run_parallel(self.conf.workers)
+        else:
+            for runner in self.runners:
+                runner.run()
+                
+        self.write_tables()
+        
+        
+    def run_parallel(self, workers):
+        
+        # Longest tasks first (LPT): the cost of a task is taken as the size of
+        # its two meshes, workers take the next task as soon as they are free
+        conf = self.conf
+        
+        for runner in self.runners:
+            runner.open_store(conf.data['files'])
+            runner.imesh.moment_arms()
+            runner.omesh.moment_arms()
+            
+        tasks = [(c, i) for c in range(len(self.runners)) for i in range(conf.np)]
+        if not tasks:
+            return
+        cost = [runner.imesh.nelements + runner.omesh.nelements for runner in self.runners]
+        tasks.sort(key=lambda task: -cost[task[0]])
+        
+        global active_runner
+        active_runner = self
+        
+        workers = min(int(workers), len(tasks))
+        
+        try:
+            with self.profiler.stage("cases"), multiprocessing.get_context("fork").Pool(workers) as pool:
+                for done, (c, i, coefficients) in enumerate(pool.imap_unordered(run_task, tasks)):
+                    runner = self.runners[c]
+                    runner.coefficients[conf.data['files'][i]] = coefficients
+                    if runner.store is not None:    # row written by the worker
+                        runner.store.commit(conf.data['files'][i], runner.case_rows[i])
+                        runner.store.checkpoint()
+                    self.profiler.progress("cases", done + 1, len(tasks))
+        finally:
+            active_runner = None
+            
+        self.profiler.count("cases", len(tasks))
+        
+        
+    def write_tables(self):
+        
+        # coefficients.txt of every component in its results directory and
+        # the whole-aircraft sums in results/coefficients.txt. The components
+        # share cs.txt, so their coefficients add up.
+        names = self.runners[0].case_names()
+        total = np.zeros((len(names), 12))
+        
+        for runner in self.runners:
+            table = np.array([runner.coefficients[name] for name in names]).reshape(len(names), 12)
+            runner.write_table("coefficients.txt", names, *self.columns(table))
+            total += table
+            
+        self.runners[0].write_table(os.path.join(self.conf.results, "coefficients.txt"), names, *self.columns(total))
+        
+        
+    @staticmethod
+    def columns(table):
+        
+        # (ncases, 12) rows to the (3, ncases) arguments of write_table
+        return table[:, 0:3].T, table[:, 3:6].T, table[:, 6:9].T, table[:, 9:12].T
+    
+    
+    def finish(self):
+        
+        for runner in self.runners:
+            if runner.store is not None:
+                runner.store.flush()
+                
+        self.profiler.write(os.path.join(self.conf.results, "run-report.json"))
+        
+        
+# Runner (or MultiRunner) inherited by the forked workers of run_parallel
+active_runner = None
+
+
+def run_case(i):
+    return i, active_runner.run_case(i)
+
+
+def run_task(task):
+    c, i = task
+    return c, i, active_runner.runners[c].run_case(i)
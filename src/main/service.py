@@ -0,0 +1,252 @@
+# -*- coding: utf-8 -*-
+import os
+import sys
+import json
+import time
+import signal
+import asyncio
+import argparse
+import threading
+import contextlib
+import numpy as np
+from config import Config
+from runner import Runner
+
+
+# Resident projection service. Meshes, mapping and transfer operator of every
+# loaded config stay in memory, requests only carry the pressures.
+#
+#   python service.py config.txt config1.txt              # JSON lines on stdin/stdout
+#   python service.py config.txt --socket /tmp/mesh.sock  # same protocol on a Unix socket
+#
+# One JSON object per line and one answer per request, in order:
+#
+#   {"id": 1, "config": "config.txt", "file": "dpress_1.txt"}
+#   {"id": 2, "config": "config.txt", "press": [0.1, 0.2, ...], "forces": false}
+#   {"op": "load", "config": "config1.txt"}
+#   {"op": "unload", "config": "config1.txt"}
+#   {"op": "list"}
+#
+# "file" is relative to the data_dir of the component (or absolute), "press"
+# holds the pressures of one case, or one row per point and one column per
+# case. Answers hold the output cell forces "cforce" and pressures "pcenter",
+# with output_press_type 0 the nodal forces "nforce" of the output grids
+# (unless "forces": false), the input and output coefficients and the time
+# spent on the request, "latency_ms". Failed requests get an "error".
+#
+# A config of several components answers with one such result per component
+# under "components" and the summed "coefficients" of the whole aircraft.
+# "file" is then read from the data_dir of every component, and "press" maps
+# every component name to its pressures.
+
+
+class Service:
+    def __init__(self):
+
+        self.runners = {}           # config file -> Runners of its components after setup
+        self.locks = {}             # config file -> lock of its meshes
+        self.lock = threading.Lock()
+
+
+    def load(self, config):
+
+        # Reading and mapping happen once per config, later loads return it.
+        # Anything printed meanwhile goes to stderr, stdout may be the protocol.
+        if config in self.runners:
+            return self.runners[config]
+
+        with self.lock:
+            if config not in self.runners:
+                runners = []
+                with contextlib.redirect_stdout(sys.stderr):
+                    for component in Config(config).component_configs():
+                        runner = Runner(component)
+                        runner.setup()
+                        runner.imesh.moment_arms()
+                        runner.omesh.moment_arms()
+                        runners.append(runner)
+                self.runners[config] = runners
+                self.locks[config] = threading.Lock()
+
+            return self.runners[config]
+
+
+    def unload(self, config):
+
+        with self.lock:
+            self.locks.pop(config, None)
+            return self.runners.pop(config, None) is not None
+
+
+    def project(self, request):
+
+        runners = self.load(request["config"])
+
+        if len(runners) == 1:
+            return self.project_component(runners[0], request, request.get("press"))[0]
+
+        # Several components: the results of each and the summed coefficients
+        press = request.get("press")
+        names = [runner.conf.name for runner in runners]
+        if press is not None and (not isinstance(press, dict) or sorted(press) != sorted(names)):
+            raise ValueError("press must map every component to its pressures: {}".format(", ".join(names)))
+
+        response = {"components": {}}
+        total = 0.0
+        for runner in runners:
+            response["components"][runner.conf.name], coefficients = self.project_component(
+                runner, request, None if press is None else press[runner.conf.name])
+            total = total + coefficients
+
+        iforces, imoments, oforces, omoments = total
+        response["coefficients"] = {"input": {"forces": iforces.tolist(), "moments": imoments.tolist()},
+                                    "output": {"forces": oforces.tolist(), "moments": omoments.tolist()}}
+
+        return response
+
+
+    def project_component(self, runner, request, press):
+
+        # Result of one component and its (4, 3[, ncases]) coefficients
+        conf = runner.conf
+        imesh = runner.imesh
+
+        npt = imesh.ngrids if int(conf.i_press_type) == 0 else imesh.nelements
+
+        if "file" in request:
+            press = imesh.load_press(os.path.join(imesh.resources_dir, conf.data_dir, request["file"]), conf.i_press_type)
+        else:
+            press = np.asarray(press, dtype=np.float64)
+
+        if press.ndim not in (1, 2) or len(press) != npt:
+            raise ValueError("expected {:d} pressures per case, got shape {}".format(npt, list(press.shape)))
+
+        # One case at a time per config, the meshes hold the case arrays
+        with self.locks[request["config"]]:
+            cforce, pcenter, iforces, imoments, oforces, omoments, nforce = runner.project_case(press)
+
+        response = {"coefficients": {"input": {"forces": iforces.tolist(), "moments": imoments.tolist()},
+                                     "output": {"forces": oforces.tolist(), "moments": omoments.tolist()}}}
+
+        if request.get("forces", True):
+            response["cforce"] = cforce.tolist()
+            response["pcenter"] = pcenter.tolist()
+            if nforce is not None:
+                response["nforce"] = nforce.tolist()
+
+        return response, np.array([iforces, imoments, oforces, omoments])
+
+
+    def handle(self, request):
+
+        # Answer of one request, errors included
+        start = time.perf_counter()
+
+        try:
+            op = request.get("op", "project")
+
+            if op == "project":
+                response = self.project(request)
+            elif op == "load":
+                runners = self.load(request["config"])
+                sizes = {runner.conf.name: {"input_elements": runner.imesh.nelements,
+                                            "output_elements": runner.omesh.nelements} for runner in runners}
+                response = {"config": request["config"]}
+                if len(runners) == 1:
+                    response.update(sizes[runners[0].conf.name])
+                else:
+                    response["components"] = sizes
+            elif op == "unload":
+                response = {"unloaded": self.unload(request["config"])}
+            elif op == "list":
+                response = {"configs": sorted(self.runners)}
+            else:
+                raise ValueError("unknown op: {}".format(op))
+
+        except Exception as error:
+            response = {"error": "{}: {}".format(type(error).__name__, error)}
+
+        if "id" in request:
+            response["id"] = request["id"]
+        response["latency_ms"] = 1000.0 * (time.perf_counter() - start)
+
+        return response
+
+
+    def handle_line(self, line):
+
+        try:
+            request = json.loads(line)
+            if not isinstance(request, dict):
+                raise ValueError("request is not a JSON object")
+        except ValueError as error:
+            return json.dumps({"error": "bad request: {}".format(error)})
+
+        return json.dumps(self.handle(request))
+
+
+    def serve_stdio(self, stdin, stdout):
+
+        for line in stdin:
+            if line.strip():
+                stdout.write(self.handle_line(line) + "\n")
+                stdout.flush()
+
+
+    async def serve_unix(self, path):
+
+        # Requests of a connection are answered in order, connections and
+        # configs run side by side in the default thread pool
+        loop = asyncio.get_running_loop()
+
+        async def client(reader, writer):
+            try:
+                while True:
+                    line = await reader.readline()
+                    if not line:
+                        break
+                    if line.strip():
+                        answer = await loop.run_in_executor(None, self.handle_line, line)
+                        writer.write(answer.encode() + b"\n")
+                        await writer.drain()
+            finally:
+                writer.close()
+
+        if os.path.exists(path):
+            os.unlink(path)
+
+        # SIGINT / SIGTERM stop the server and remove the socket
+        stop = asyncio.Event()
+        for signum in (signal.SIGINT, signal.SIGTERM):
+            loop.add_signal_handler(signum, stop.set)
+
+        server = await asyncio.start_unix_server(client, path, limit=2 ** 30)
+        try:
+            async with server:
+                await stop.wait()
+        finally:
+            if os.path.exists(path):
+                os.unlink(path)
+
+
+def main():
+
+    parser = argparse.ArgumentParser(description="Resident projection service")
+    parser.add_argument("configs", nargs="*", help="config files in resources to load at start")
+    parser.add_argument("--socket", help="Unix socket path, stdin/stdout if omitted")
+    args = parser.parse_args()
+
+    service = Service()
+    for config in args.configs:
+        service.load(config)
+
+    if args.socket:
+        asyncio.run(service.serve_unix(args.socket))
+    else:
+        service.serve_stdio(sys.stdin, sys.stdout)
+
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,341 @@
+# -*- coding: utf-8 -*-
+import io
+import os
+import sys
+import json
+import time
+import shutil
+import socket
+import argparse
+import multiprocessing
+import numpy as np
+from config import Config
+from cache import file_digest
+from runner import Runner, MultiRunner
+
+
+# Sharded runs over a shared directory, for case sets spread over several
+# machines. Every node runs from the same checkout and sees the same shared
+# directory (NFS or similar):
+#
+#   python shard.py init config.txt --dir /shared/run1 --range 16     # once
+#   python shard.py work --dir /shared/run1 [--processes 4]            # on every node
+#   python shard.py status --dir /shared/run1
+#   python shard.py merge --dir /shared/run1                           # at the end
+#
+# init copies the config to /shared/run1/config.txt, builds the mapping of
+# every component into /shared/run1/cache and writes manifest.json, with the
+# case names and a hash of the config and mesh files, and one file per range
+# of cases in queue/todo. Workers and merge use that copy and those names, and
+# stop if the hash no longer matches. A
+# worker claims a range by renaming its file to queue/claimed/<range>~<worker>
+# (rename is atomic, one worker wins) and touches that file after every case:
+# its mtime is the lease. Ranges whose lease is older than `lease` seconds are
+# claimed again by the next free worker. Every finished case leaves its
+# coefficients in cases/, so a claimed-again range only runs the cases left.
+# A finished range moves to queue/done. merge writes coefficients.txt from
+# cases/ once every case is there.
+#
+# Results are text files (forces_<i>*.txt) in /shared/run1/results, or
+# results/<name> for several components, whatever the `output` of the config.
+
+
+class Shard:
+    def __init__(self, shared_dir):
+
+        self.shared_dir = os.path.abspath(shared_dir)
+        self.manifest_path = os.path.join(self.shared_dir, "manifest.json")
+        self.todo_dir = os.path.join(self.shared_dir, "queue", "todo")
+        self.claimed_dir = os.path.join(self.shared_dir, "queue", "claimed")
+        self.done_dir = os.path.join(self.shared_dir, "queue", "done")
+        self.cases_dir = os.path.join(self.shared_dir, "cases")
+        self.config_path = os.path.join(self.shared_dir, "config.txt")
+        self.manifest = None
+
+
+    def config(self, filename):
+
+        # The config of the run with its results and mapping cache in the
+        # shared directory
+        conf = Config(filename)
+        conf.results = conf.results_dir = os.path.join(self.shared_dir, "results")
+        conf.cache = True
+        conf.cache_dir = os.path.join(self.shared_dir, "cache")
+        conf.output = "text"
+
+        return conf
+
+
+    def init(self, filename, size=16, lease=600.0):
+
+        # Coordinator: mapping artifacts, manifest and queue of case ranges
+        if os.path.exists(self.manifest_path):
+            raise ValueError("{} exists, the run is already set up".format(self.manifest_path))
+
+        os.makedirs(self.shared_dir, exist_ok=True)
+        shutil.copyfile(Config(filename).configpath, self.config_path)
+        conf = self.config(self.config_path)
+
+        # Building the mapping once fills the shared cache, workers load it
+        for component in conf.component_configs():
+            Runner(component).setup()
+
+        size = max(int(size), 1)
+        ranges = []
+        for c in range(len(conf.components)):
+            for start in range(0, conf.np, size):
+                stop = min(start + size, conf.np)
+                ranges.append({"id": "c{:d}-{:06d}-{:06d}".format(c, start, stop), "component": c, "start": start, "stop": stop})
+
+        self.manifest = {"config": filename, "cases": conf.data['files'], "hash": file_digest(self.inputs(conf)).hexdigest(),
+                         "components": [component['name'] for component in conf.components],
+                         "range": size, "lease": float(lease), "ranges": ranges}
+
+        for path in (self.todo_dir, self.claimed_dir, self.done_dir, self.cases_dir):
+            os.makedirs(path, exist_ok=True)
+
+        for item in ranges:
+            open(os.path.join(self.todo_dir, item["id"]), 'w').close()
+
+        # Written last: workers start once the queue is complete
+        atomic_write(self.manifest_path, json.dumps(self.manifest, indent=1).encode())
+
+        return self.manifest
+
+
+    def inputs(self, conf):
+
+        # Files a run depends on besides the pressures: the config copy, the
+        # meshes of every component and cs.txt
+        files = [conf.configpath, os.path.join(conf.resources_dir, "cs.txt")]
+        for component in conf.component_configs():
+            files += [os.path.join(conf.resources_dir, component.data_dir, name) for name in
+                      (component.i_grids_file, component.i_elements_file, component.o_grids_file, component.o_elements_file)]
+
+        return files
+
+
+    def run_config(self):
+
+        # Config of the workers and merge: the copy made by init, with the
+        # cases of the manifest
+        manifest = self.load()
+        conf = self.config(self.config_path)
+
+        if file_digest(self.inputs(conf)).hexdigest() != manifest["hash"]:
+            raise ValueError("the config copy or the mesh files of {} changed since init".format(self.shared_dir))
+
+        conf.data['files'] = list(manifest["cases"])
+        conf.np = len(conf.data['files'])
+
+        return conf
+
+
+    def load(self):
+
+        if self.manifest is None:
+            with open(self.manifest_path) as file:
+                self.manifest = json.load(file)
+
+        return self.manifest
+
+
+    def case_path(self, component, i):
+        return os.path.join(self.cases_dir, "c{:d}-{:06d}.npy".format(component, i))
+
+
+    def claim(self, worker):
+
+        # Next range for worker: a new one, else one it held before a restart
+        # or one whose lease expired. Returns (range, claim path) or None.
+        ranges = {item["id"]: item for item in self.load()["ranges"]}
+
+        for name in sorted(os.listdir(self.todo_dir)):
+            path = os.path.join(self.claimed_dir, "{}~{}".format(name, worker))
+            try:
+                os.rename(os.path.join(self.todo_dir, name), path)
+            except FileNotFoundError:       # taken by another worker
+                continue
+            return ranges[name], path
+
+        now = time.time()
+        for name in sorted(os.listdir(self.claimed_dir)):
+            range_id, holder = name.split("~", 1)
+            old = os.path.join(self.claimed_dir, name)
+            path = os.path.join(self.claimed_dir, "{}~{}".format(range_id, worker))
+            try:
+                if holder != worker:
+                    if now - os.stat(old).st_mtime < self.manifest["lease"]:
+                        continue
+                    os.rename(old, path)
+                os.utime(path)
+            except FileNotFoundError:
+                continue
+            return ranges[range_id], path
+
+        return None
+
+
+    def work(self, worker=None, poll=5.0):
+
+        # Worker: claims and runs ranges until every range is done. Returns
+        # the number of cases run.
+        manifest = self.load()
+        worker = worker or "{}-{:d}".format(socket.gethostname(), os.getpid())
+        conf = self.run_config()
+        components = conf.component_configs()
+        runners = {}
+        ncases = 0
+
+        while True:
+            claimed = self.claim(worker)
+
+            if claimed is None:
+                if not os.listdir(self.todo_dir) and not os.listdir(self.claimed_dir):
+                    break
+                time.sleep(poll)        # ranges still held by live workers
+                continue
+
+            item, path = claimed
+            c = item["component"]
+
+            if c not in runners:
+                runners[c] = self.runner(components[c], worker)
+            runner = runners[c]
+
+            try:
+                for i in range(item["start"], item["stop"]):
+                    if os.path.exists(self.case_path(c, i)):
+                        continue
+                    coefficients = runner.run_case(i)
+                    atomic_write(self.case_path(c, i), npy_bytes(coefficients))
+                    ncases += 1
+                    os.utime(path)      # lease renewed
+                os.rename(path, os.path.join(self.done_dir, item["id"]))
+            except FileNotFoundError:
+                # Lease lost: the range was claimed again, the finished cases stay
+                if os.path.exists(path):
+                    raise
+
+        for c, runner in runners.items():
+            runner.profiler.write(os.path.join(self.shared_dir, "workers", worker, components[c].name, "run-report.json"))
+
+        return ncases
+
+
+    def runner(self, conf, worker):
+
+        # Meshes and mapping (from the shared cache) of one component, with
+        # the map log of this worker in workers/<worker>/<name>
+        results_dir = conf.results_dir
+        conf.results_dir = os.path.join(self.shared_dir, "workers", worker, conf.name)
+
+        runner = Runner(conf)
+        runner.setup()
+
+        os.makedirs(results_dir, exist_ok=True)
+        runner.imesh.results_dir = runner.omesh.results_dir = results_dir
+
+        return runner
+
+
+    def status(self):
+
+        # Ranges to do, claimed and done, and cases finished
+        manifest = self.load()
+        return {"todo": len(os.listdir(self.todo_dir)), "claimed": len(os.listdir(self.claimed_dir)),
+                "done": len(os.listdir(self.done_dir)), "ranges": len(manifest["ranges"]),
+                "cases_done": len([name for name in os.listdir(self.cases_dir) if name.endswith(".npy")]),
+                "cases": len(manifest["cases"]) * len(manifest["components"])}
+
+
+    def merge(self):
+
+        # coefficients.txt of every component from the finished cases, and
+        # the sums in results/coefficients.txt for several components
+        manifest = self.load()
+        conf = self.run_config()
+        names = manifest["cases"]
+
+        missing = [(c, i) for c in range(len(manifest["components"])) for i in range(len(names))
+                   if not os.path.exists(self.case_path(c, i))]
+        if missing:
+            raise ValueError("{:d} cases not done yet, first: component {:d} case {:d}".format(len(missing), *missing[0]))
+
+        total = np.zeros((len(names), 12))
+        for c, component in enumerate(conf.component_configs()):
+            table = np.array([np.load(self.case_path(c, i)) for i in range(len(names))])
+            Runner(component).write_table("coefficients.txt", names, *MultiRunner.columns(table))
+            total += table
+
+        if len(manifest["components"]) > 1:
+            Runner(conf).write_table(os.path.join(conf.results, "coefficients.txt"), names, *MultiRunner.columns(total))
+
+        return os.path.join(conf.results, "coefficients.txt")
+
+
+def npy_bytes(array):
+
+    buffer = io.BytesIO()
+    np.save(buffer, array)
+    return buffer.getvalue()
+
+
+def atomic_write(path, data):
+
+    # Write then rename, readers on any node see the whole file or nothing
+    tmppath = "{}.{}.{:d}.tmp".format(path, socket.gethostname(), os.getpid())
+    with open(tmppath, 'wb') as file:
+        file.write(data)
+        file.flush()
+        os.fsync(file.fileno())
+    os.replace(tmppath, path)
+
+
+def work(args):
+
+    shared_dir, worker, poll = args
+    return Shard(shared_dir).work(worker, poll)
+
+
+def main():
+
+    parser = argparse.ArgumentParser(description="Sharded runs over a shared directory")
+    parser.add_argument("command", choices=["init", "work", "status", "merge"])
+    parser.add_argument("config", nargs="?", help="config file in resources (init)")
+    parser.add_argument("--dir", required=True, help="shared directory of the run")
+    parser.add_argument("--range", type=int, default=16, help="cases per range (init)")
+    parser.add_argument("--lease", type=float, default=600.0, help="seconds before a silent worker's range is claimed again (init)")
+    parser.add_argument("--processes", type=int, default=1, help="local worker processes (work)")
+    parser.add_argument("--worker", help="worker name, <host>-<pid> by default (work)")
+    parser.add_argument("--poll", type=float, default=5.0, help="seconds between looks at a busy queue (work)")
+    args = parser.parse_args()
+
+    shard = Shard(args.dir)
+
+    if args.command == "init":
+        if not args.config:
+            parser.error("init needs a config")
+        manifest = shard.init(args.config, args.range, args.lease)
+        print("{:d} ranges of {:d} cases in {}".format(len(manifest["ranges"]), manifest["range"], shard.shared_dir))
+
+    elif args.command == "work":
+        if args.processes > 1:
+            names = ["{}-{:d}-{:d}".format(socket.gethostname(), os.getpid(), k) for k in range(args.processes)]
+            with multiprocessing.Pool(args.processes) as pool:
+                done = sum(pool.map(work, [(args.dir, name, args.poll) for name in names]))
+        else:
+            done = shard.work(args.worker, args.poll)
+        print("{:d} cases run".format(done))
+
+    elif args.command == "status":
+        print(json.dumps(shard.status()))
+
+    elif args.command == "merge":
+        print(shard.merge())
+
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
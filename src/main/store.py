@@ -0,0 +1,160 @@
+# -*- coding: utf-8 -*-
+import os
+import json
+import time
+import numpy as np
+
+
+class ResultStore:
+    # Results of all load cases in one directory of memory-mapped .npy
+    # columns, one row per case, plus index.json mapping case names to rows:
+    #   cforce.npy        (ncases, nelements, 3)  output cell forces
+    #   pcenter.npy       (ncases, nelements)     summed pressures per cell
+    #   coefficients.npy  (ncases, 12)            input then output CF/CM
+    # Reading a case only touches the pages of its rows.
+    fields = ("cforce", "pcenter", "coefficients")
+
+    def __init__(self, path, mode='r'):
+
+        # mode: 'r' read only, 'r+' to add cases to an existing store
+        self.path = path
+        self.mode = mode
+
+        with open(os.path.join(path, "index.json"), 'r') as file:
+            index = json.load(file)
+
+        self.nelements = index["nelements"]
+        self.mesh = index.get("mesh")           # hash of the output mesh files
+        self.rows = index["cases"]              # case name -> row, written cases only
+        self.reserved = {}                      # rows of cases not written yet
+        self.flushed = time.monotonic()
+        self.columns = {name: np.load(os.path.join(path, name + ".npy"), mmap_mode=mode) for name in self.fields}
+
+
+    @classmethod
+    def create(cls, path, nelements, capacity, mesh=None):
+
+        os.makedirs(path, exist_ok=True)
+
+        for name in cls.fields:
+            column = np.lib.format.open_memmap(os.path.join(path, name + ".npy"), mode='w+', dtype=np.float64,
+                                               shape=(max(int(capacity), 1),) + cls.row_shape(name, nelements))
+            column[:] = np.nan
+            column.flush()
+            del column
+
+        with open(os.path.join(path, "index.json"), 'w') as file:
+            json.dump({"nelements": int(nelements), "mesh": mesh, "cases": {}}, file)
+
+        return cls(path, 'r+')
+
+
+    @staticmethod
+    def row_shape(name, nelements):
+        return {"cforce": (nelements, 3), "pcenter": (nelements,), "coefficients": (12,)}[name]
+
+
+    @property
+    def capacity(self):
+        return len(self.columns["pcenter"])
+
+
+    def write(self, row, name, cforce, pcenter, coefficients):
+
+        # Case `name` at a given row, as done by the parallel workers
+        if row >= self.capacity:
+            self.grow(row + 1)
+
+        self.columns["cforce"][row] = cforce
+        self.columns["pcenter"][row] = pcenter
+        self.columns["coefficients"][row] = coefficients
+        self.commit(name, row)
+
+
+    def commit(self, name, row):
+
+        # Case `name` written at row, by this process or a forked worker: it
+        # goes to the index at the next flush
+        self.rows[name] = int(row)
+        self.reserved.pop(name, None)
+
+
+    def row(self, name):
+
+        # Row of a case, a new one at the end for an unknown name. The new row
+        # is only listed in the index once the case is written.
+        if name in self.rows:
+            return self.rows[name]
+
+        if name not in self.reserved:
+            self.reserved[name] = max(list(self.rows.values()) + list(self.reserved.values()), default=-1) + 1
+
+        return self.reserved[name]
+
+
+    def append(self, name, cforce, pcenter, coefficients):
+
+        self.write(self.row(name), name, cforce, pcenter, coefficients)
+
+
+    def grow(self, nrows):
+
+        # Double the capacity until nrows fit, rows already written are kept
+        capacity = self.capacity
+        while capacity < nrows:
+            capacity *= 2
+
+        for name, column in self.columns.items():
+            column.flush()
+            filepath = os.path.join(self.path, name + ".npy")
+            tmppath = filepath + ".tmp"
+            grown = np.lib.format.open_memmap(tmppath, mode='w+', dtype=column.dtype, shape=(capacity,) + column.shape[1:])
+            grown[:len(column)] = column
+            grown[len(column):] = np.nan
+            grown.flush()
+            del grown
+            os.replace(tmppath, filepath)
+            self.columns[name] = np.load(filepath, mmap_mode='r+')
+
+
+    def flush(self):
+
+        # Columns first, so the index never lists a row not on disk
+        for column in self.columns.values():
+            if isinstance(column, np.memmap) and self.mode != 'r':
+                column.flush()
+
+        tmppath = os.path.join(self.path, "index.json.tmp")
+        with open(tmppath, 'w') as file:
+            json.dump({"nelements": self.nelements, "mesh": self.mesh, "cases": self.rows}, file)
+        os.replace(tmppath, os.path.join(self.path, "index.json"))
+        self.flushed = time.monotonic()
+
+
+    def checkpoint(self, interval=1.0):
+
+        # Flush during a run, at most once every interval seconds: a crash
+        # loses the cases of the last interval only
+        if time.monotonic() - self.flushed >= interval:
+            self.flush()
+
+
+    def names(self):
+        return sorted(self.rows, key=self.rows.get)
+
+
+    def load(self, name):
+
+        # One case: dict of memory-mapped rows
+        row = self.rows[name]
+        return {field: column[row] for field, column in self.columns.items()}
+
+
+    def load_cases(self, names):
+
+        # Several cases, by list of names or slice of the case order
+        if isinstance(names, slice):
+            names = self.names()[names]
+
+        rows = [self.rows[name] for name in names]
+        return {field: column[rows] for field, column in self.columns.items()}
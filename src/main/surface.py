@@ -1,7 +1,13 @@
 # -*- coding: utf-8 -*-
 import os
 import numpy as np
-from scipy.spatial.qhull import Delaunay
+from scipy.sparse import csr_matrix
+from mapping import PanelIndex, points_inside_panels, shape_weights
+from bvh import TriangleBVH
+from textio import read_table
+from frame import Frame
+from profiler import Profiler
+from vtkwriter import write_vtk, write_vtu
 
 
 class Surface:
@@ -11,50 +17,48 @@ class Surface:
         self.ngrids = 0
         self.nelements = 0
         self.mesh_type = int(mesh_type)
+        self.dtype = np.float64     # coordinates, areas and pressures, np.float32 to halve them
+        self.sidecar = True         # binary copies of the text inputs
+        self.profiler = Profiler()  # disabled unless replaced
         
         # directories
         self.main_dir = os.path.dirname(os.path.abspath(__file__))
         self.resources_dir = os.path.join(self.main_dir, '../resources')
         self.results_dir = os.path.join(self.main_dir, '../results')         
+        self.cspath = os.path.join(self.resources_dir, "cs.txt")
+        self.frame = None
+        self.arms = None
+        self.averaging = None   # grid to element center pressures, for pressures on grids
+        self.nodal = None       # input points to output grids, for nodal forces
+        self.nforce = None
 
         
     def read_grids(self, filedir, filename):
         
         filepath = os.path.join(self.resources_dir, filedir, filename)
         
-        with open(filepath, 'r') as file:
-            line = file.readline()
-            temp = line.split()
-            self.ngrids = int(temp[0])                  # Number of grids
-            self.grids = np.empty((self.ngrids, 3))
-            self.ids = np.empty(self.ngrids)
-            
-            for i in range(self.ngrids):
-                line = file.readline()
-                temp = line.split()
-                self.ids[i] = int(temp[0])              # Reading grid id   
-                self.grids[i, 0] = float(temp[1])       # Reading grid x coordinate  
-                self.grids[i, 1] = float(temp[2])       # Reading grid y coordinate 
-                self.grids[i, 2] = float(temp[3])       # Reading grid z coordinate 
+        table = read_table(filepath, header=True, sidecar=self.sidecar)
+        self.ngrids = len(table)                    # Number of grids
+        self.ids = table[:, 0].astype(np.int32)     # Grid ids
+        self.grids = table[:, 1:4].astype(self.dtype, copy=False)   # Grid x, y, z coordinates
+        
+        # Grid ids need not be contiguous: rows are found by binary search
+        # on the sorted ids, done once for the connectivity
+        self.id_order = np.argsort(self.ids, kind='stable').astype(np.int32)
+        self.sorted_ids = self.ids[self.id_order]
+        if np.any(self.sorted_ids[1:] == self.sorted_ids[:-1]):
+            raise ValueError("duplicate grid ids in {}".format(filepath))
                 
                 
     def read_elements(self, filedir, filename):
         
         filepath = os.path.join(self.resources_dir, filedir, filename)
         
-        with open(filepath, 'r') as file:
-            line = file.readline()
-            temp = line.split()
-            self.nelements = int(temp[0])                  # Number of elements
-            self.elements = np.empty((self.nelements, self.mesh_type))
-            self.centers = np.empty((self.nelements, 3))
-            self.area = np.empty((self.nelements, 4))
-
-            for i in range(self.nelements):
-                line = file.readline()
-                temp = line.split()
-                for j in range(self.mesh_type):
-                    self.elements[i, j] = int(temp[j])       # Reading elements
+        table = read_table(filepath, header=True, sidecar=self.sidecar)
+        self.nelements = len(table)                 # Number of elements
+        self.elements = table[:, 0:self.mesh_type].astype(np.int32)    # Element grids
+        self.centers = np.empty((self.nelements, 3), dtype=self.dtype)
+        self.area = np.empty((self.nelements, 4), dtype=self.dtype)
                     
         self.calc_panel_centers()
                     
@@ -63,61 +67,118 @@ class Surface:
         
         filepath = os.path.join(self.resources_dir, filedir, filename)
         
-        with open(filepath, 'r') as file:
-            if (int(ptype) == 0):  # press on grids
-                self.press = np.empty(self.ngrids)
-                for i in range(self.ngrids):
-                        line = file.readline()
-                        temp = line.split()
-                        self.press[i] = float(temp[1])
-                        
-            elif (int(ptype) == 1):  # press on element centers
-                self.press = np.empty(self.nelements)
-                for i in range(self.nelements):
-                        line = file.readline()
-                        temp = line.split()
-                        self.press[i] = float(temp[1])
+        self.press = self.load_press(filepath, ptype)
+        
+        
+    def read_press_batch(self, filedir, filenames, ptype):
+        
+        # All load cases at once, one column per pressure file
+        npt = self.ngrids if int(ptype) == 0 else self.nelements
+        self.press = np.empty((npt, len(filenames)), dtype=self.dtype)
+        
+        for k, filename in enumerate(filenames):
+            filepath = os.path.join(self.resources_dir, filedir, filename)
+            self.press[:, k] = self.load_press(filepath, ptype)
+            
+            
+    def load_press(self, filepath, ptype):
+        
+        # The first column holds grid ids (ptype 0) or element numbers, 1 to
+        # nelements (ptype 1). Rows may come in any order.
+        table = read_table(filepath, sidecar=self.sidecar)
+        
+        if (int(ptype) == 0):  # press on grids
+            rows = self.grid_rows(table[:, 0])
+            npt = self.ngrids
+            
+        elif (int(ptype) == 1):  # press on element centers
+            rows = self.element_rows(table[:, 0])
+            npt = self.nelements
+            
+        if len(rows) == npt and np.array_equal(rows, np.arange(npt)):     # already in row order
+            return np.array(table[:, 1], dtype=self.dtype)
+        
+        press = np.full(npt, np.nan, dtype=self.dtype)
+        press[rows] = table[:, 1]
+        
+        missing = np.count_nonzero(np.isnan(press))
+        if missing:
+            raise ValueError("{}: no pressure for {:d} of {:d} points".format(filepath, missing, npt))
+        
+        return press
+    
+    
+    def grid_rows(self, ids):
+        
+        # Rows in grids of grid ids, any shape
+        ids = np.asarray(ids).astype(np.int64)
+        pos = np.minimum(np.searchsorted(self.sorted_ids, ids), self.ngrids - 1)
+        
+        found = self.sorted_ids[pos] == ids
+        if not np.all(found):
+            raise ValueError("unknown grid ids: {}".format(np.unique(ids[~found])[:10].tolist()))
+        
+        return self.id_order[pos]
+    
+    
+    def element_rows(self, numbers):
+        
+        # Rows of element numbers, 1 to nelements in the order of the elements file
+        rows = np.asarray(numbers).astype(np.int64) - 1
+        
+        bad = (rows < 0) | (rows >= self.nelements)
+        if np.any(bad):
+            raise ValueError("element numbers out of 1..{:d}: {}".format(self.nelements, (rows[bad] + 1)[:10].tolist()))
+        
+        return rows.astype(np.int32)
      
 
     def is_point_inside_panel(self, panel_grids, center, plane):
-        g1, g2 = 0, 1  # Default values for plane xy
-
-        if int(plane) == 1:  # Adjust values for plane xz
-            g2 = 2
-            
-
-        grids = panel_grids[:, [g1, g2]]
-
-        point_to_check = center[[g1, g2]]
         
-        triangulation = Delaunay(grids)
-        simplex_index = triangulation.find_simplex(point_to_check, tol=1e-10)
-        
-        is_inside = simplex_index != -1
+        is_inside = points_inside_panels(panel_grids[None, :, :], center[None, :], plane)[0]
        
         return is_inside
 
 
-    def mapgrids(self, points, npi, plane):
-        
-        self.mapg = np.zeros((npi))
-        check_points = np.zeros(npi, dtype=bool)
-        ch = 0
-        self.mapg[:] = -1
+    def mapgrids(self, points, npi, plane, chunk=65536, tol=1e-10, cache=None, key=None, last_key=None,
+                 nearest='off', max_distance=None):
         
-        for i in range(self.nelements):  # For each cell in target mesh
-            panel_grids = self.grids[self.elements[i, :].astype(int) - 1, :]   # grid array        
-
-            for j in range(npi): # Evaluate each point with pressure from the input mesh
-                            
-                if not check_points[j]:
-                    check = self.is_point_inside_panel(panel_grids, points[j, :], plane)
+        # cache: optional MapCache, key: its entry for these meshes and parameters
+        # last_key: entry of the last mapping of the same input mesh and
+        # parameters, whatever the output mesh, for incremental remapping
+        # nearest: 'off', 'fallback' for the nearest panel in 3-D of the points
+        # outside every panel in the plane, or 'primary' for every point.
+        # max_distance: points farther from every panel stay unmapped.
+        entry = None
+        if cache is not None:
+            entry = cache.load(key)
+            
+        if entry is not None:   # Same meshes as a previous run, no search
+            self.profiler.count("map_cache_hits")
+            self.mapg = entry['mapg'].astype(np.int32, copy=False)
+            self.distance = entry['distance'] if 'distance' in entry else np.full(npi, np.nan)
+            self.transfer = csr_matrix((entry['data'].astype(self.dtype, copy=False), entry['indices'], entry['indptr']),
+                                       shape=(self.nelements, npi))
+        else:
+            if nearest == 'primary':
+                self.mapg = np.full(npi, -1, dtype=np.int32)
+            else:
+                last = cache.load(last_key) if (cache is not None and last_key is not None) else None
+                if last is None or not self.remap(points, npi, plane, last, chunk, tol):
+                    self.search_points(points, npi, plane, chunk, tol)
                     
-                if (check == True and check_points[j] == False):
-                    check_points[j] = True
-                    self.mapg[j] = i     
-                    ch += 1
-                    print(str(ch) + "/" + str(npi))
+            self.distance = np.full(npi, np.nan)    # distance to the nearest panel, nan if mapped in the plane
+            if nearest != 'off':
+                self.nearest_points(points, np.flatnonzero(self.mapg < 0), max_distance)
+                
+            self.build_transfer(npi)
+            if cache is not None:
+                cache.save(key, mapg=self.mapg, distance=self.distance, data=self.transfer.data, indices=self.transfer.indices,
+                           indptr=self.transfer.indptr)
+                
+            # Only a new mapping replaces the last one, a cache hit leaves it
+            if cache is not None and last_key is not None:
+                cache.save(last_key, mapg=self.mapg, panels=self.grids[self.conn].astype(np.float64, copy=False))
                     
         filepath = os.path.join(self.results_dir, "map-log.txt")
         
@@ -126,95 +187,296 @@ class Surface:
             for j in range(npi):
                 if (self.mapg[j] == -1):
                     file.write("{:8d} {:12.6f} {:12.6f} {:12.6f}\n".format(j, points[j, 0], points[j, 1], points[j, 2]))
+                    
+            if nearest != 'off':
+                file.write("Nearest panels\n")
+                rows = np.flatnonzero(~np.isnan(self.distance))
+                np.savetxt(file, np.column_stack((rows, self.mapg[rows], self.distance[rows])), fmt="%8d %8d %14.6e")
+                    
+        mapped = int(np.count_nonzero(self.mapg >= 0))
+        self.profiler.count("points_mapped", mapped)
+        self.profiler.count("points_missing", npi - mapped)
                       
-
-    def projectmesh(self, points, areas, pressures, plane):
+                      
+    def search_points(self, points, npi, plane, chunk, tol, rows=None):
+        
+        # rows: points to search again, the others keep their cell in mapg
+        if rows is None:
+            self.mapg = np.full(npi, -1, dtype=np.int32)     # output cell of every point, -1 if none
+            rows = np.arange(npi)
+        else:
+            self.mapg[rows] = -1
+        
+        # The search is done in double precision whatever the mesh dtype
+        panel_grids = self.grids[self.conn, :].astype(np.float64, copy=False)   # grid array, (nelements, mesh_type, 3)
+        points = points.astype(np.float64, copy=False)
+        
+        # Only panels whose bounding box overlaps a point are tested
+        index = PanelIndex(panel_grids, plane)
+        
+        for j0 in range(0, len(rows), chunk):  # Points with pressure from the input mesh, by chunks
+            block = rows[j0:j0 + chunk]
+            point, panel = index.candidates(points[block, :])
+            self.profiler.count("panels_tested", len(panel))
+            inside = points_inside_panels(panel_grids[panel], points[block[point], :], plane, tol)
+            
+            # Candidates are sorted by panel, the first containing cell wins
+            point = point[inside]
+            panel = panel[inside]
+            point, first = np.unique(point, return_index=True)
+            self.mapg[block[point]] = panel[first]
+            self.profiler.progress("mapgrids", j0 + len(block), len(rows))
+            
+            
+    def nearest_points(self, points, rows, max_distance=None):
         
-        # points: points with pressure in original mesh
-        # pressures: pressures from original mesh
-        # areas: panel areas from original mesh
+        # Maps points[rows] to their nearest panel in 3-D, within max_distance.
+        # Quads are split in two triangles, ties go to the lowest panel.
+        if len(rows) == 0:
+            return
         
-        self.pcenter = np.zeros(self.nelements)
-        self.cforce = np.zeros((self.nelements, 3))
+        panel_grids = self.grids[self.conn].astype(np.float64, copy=False)
+        triangles = panel_grids[:, 0:3]
+        panel = np.arange(self.nelements)
         
-        npi = len(pressures)
+        if (self.mesh_type == 4):
+            quad = np.flatnonzero(self.nnodes == 4)
+            triangles = np.concatenate((triangles, panel_grids[quad][:, [0, 2, 3]]))
+            panel = np.concatenate((panel, quad))
+            
+        tree = TriangleBVH(triangles)
+        max_distance = np.inf if max_distance is None else float(max_distance)
+        triangle, distance = tree.nearest(points[rows].astype(np.float64, copy=False), max_distance)
+        
+        found = triangle >= 0
+        self.mapg[rows[found]] = panel[triangle[found]]
+        self.distance[rows[found]] = distance[found]
+        self.profiler.count("points_nearest", int(np.count_nonzero(found)))
+        
+        
+    def remap(self, points, npi, plane, last, chunk, tol):
+        
+        # Incremental mapping from the last mapping of the same input mesh.
+        # Panels are matched by their node coordinates, points stay in their
+        # unchanged cell unless a changed or new panel's bounding box holds
+        # them. Returns False, leaving a full search to the caller, when the
+        # unchanged panels were reordered or a mesh repeats a panel.
+        panel_grids = self.grids[self.conn].astype(np.float64, copy=False)
+        old_grids = last['panels']
+        old_mapg = last['mapg']
+        
+        if len(old_mapg) != npi or old_grids.shape[1:] != panel_grids.shape[1:]:
+            return False
+        
+        nold = len(old_grids)
+        rows = np.concatenate((old_grids.reshape(nold, -1), panel_grids.reshape(self.nelements, -1)))
+        inverse = np.unique(rows, axis=0, return_inverse=True)[1].ravel()
+        old_id, new_id = inverse[:nold], inverse[nold:]
+        
+        if len(np.unique(old_id)) < nold or len(np.unique(new_id)) < self.nelements:
+            return False
+        
+        # Old panel -> same panel in the new mesh, -1 for changed or removed ones
+        slot = np.full(len(rows), -1, dtype=np.int64)
+        slot[new_id] = np.arange(self.nelements)
+        old_to_new = slot[old_id]
+        
+        matched = old_to_new[old_to_new >= 0]
+        if np.any(np.diff(matched) <= 0):
+            return False
+        
+        changed = np.ones(self.nelements, dtype=bool)
+        changed[matched] = False
+        changed = np.flatnonzero(changed)
+        
+        self.mapg = np.where(old_mapg >= 0, old_to_new[np.maximum(old_mapg, 0)], -1).astype(np.int32)
+        retest = (old_mapg >= 0) & (self.mapg < 0)      # cell changed or removed
+        
+        if len(changed):
+            points = points.astype(np.float64, copy=False)
+            index = PanelIndex(panel_grids[changed], plane, pad=PanelIndex.padding(panel_grids, plane))
+            retest[index.candidates(points)[0]] = True
+            
+        rows = np.flatnonzero(retest)
+        self.profiler.count("panels_changed", len(changed))
+        self.profiler.count("points_retested", len(rows))
         
-        for i in range(self.nelements):  # For each cell in target mesh
+        if len(rows):
+            self.search_points(points, npi, plane, chunk, tol, rows)
             
-            forces = np.zeros(3)
+        return True
             
-            for j in range(npi): # Evaluate each point with pressure from the input mesh
-                if (self.mapg[j] == i):
-                    self.pcenter[i] += pressures[j]
-                    forces[:] += pressures[j] * areas[j, 0:3]
+
+    def build_transfer(self, npi):
+        
+        # Sparse operator from input points to output cells: row i holds a 1
+        # for every input point mapped into cell i
+        mapped = np.flatnonzero(self.mapg >= 0)
+        self.transfer = csr_matrix((np.ones(len(mapped), dtype=self.dtype), (self.mapg[mapped], mapped)), shape=(self.nelements, npi))
+        
+
+    def projectmesh(self, points, areas, pressures, plane):
+        
+        # points: points with pressure in original mesh
+        # pressures: pressures from original mesh, (npi) or (npi, ncases)
+        # areas: panel areas from original mesh
+        
+        self.pcenter = self.transfer @ pressures
+        
+        if pressures.ndim == 1:
+            forces = pressures[:, None] * areas[:, 0:3]
+            self.cforce = self.transfer @ forces
+            if self.nodal is not None:
+                self.nforce = self.nodal @ forces
+        else:   # cforce is (nelements, 3, ncases), nforce (ngrids, 3, ncases)
+            ncases = pressures.shape[1]
+            forces = (pressures[:, None, :] * areas[:, 0:3, None]).reshape(len(pressures), 3 * ncases)
+            self.cforce = (self.transfer @ forces).reshape(self.nelements, 3, ncases)
+            if self.nodal is not None:
+                self.nforce = (self.nodal @ forces).reshape(self.ngrids, 3, ncases)
             
-            self.cforce[i, :] = forces[:]
             
+    def build_nodal(self, points, plane):
+        
+        # Sparse (ngrids, npi) operator spreading the force of every mapped
+        # input point over the grids of its output panel, with the shape
+        # function weights of the point in the panel
+        mapped = np.flatnonzero(self.mapg >= 0)
+        panel = self.mapg[mapped]
+        
+        weights = shape_weights(self.grids[self.conn[panel]], points[mapped], plane, self.nnodes[panel])
+        
+        # The repeated grid of the triangles of a quad mesh has a weight of 0
+        rows = self.conn[panel].ravel()
+        columns = np.repeat(mapped, self.mesh_type)
+        self.nodal = csr_matrix((weights.ravel().astype(self.dtype), (rows, columns)), shape=(self.ngrids, len(self.mapg)))
+        
+        
+    def write_nodal(self, fout, nforce):
+        
+        # Grid id, nodal force and its moment about the reference point
+        filepath = os.path.join(self.results_dir, fout)
+        
+        arms = self.grids - Frame.load(self.cspath).refpoint
+        nmoment = np.cross(nforce, arms)
+        
+        np.savetxt(filepath, np.column_stack((self.ids, nforce, nmoment)), fmt="%8d" + " %.6e" * 6)
+        
 
  
 
     def write_projected_mesh(self, fout):
         
-        filepath = os.path.join(self.results_dir, fout)
-        
         fout2 = fout.replace(".txt", "_output_int.txt")
         
+        self.write_forces(fout, self.cforce)
+        
+        self.intmesh2(fout2)
+        
+        
+    def write_forces(self, fout, cforce):
+        
+        filepath = os.path.join(self.results_dir, fout)
+        
         with open(filepath, 'w') as file:
             for i in range(self.nelements):
                 file.write("{:12.6f} {:12.6f} {:12.6f} {:.6e} {:.6e} {:.6e} {:.7e} {:.7e} {:.7e} {:.7e}\n".format(self.centers[i, 0], \
                                                                                                                        self.centers[i, 1], \
                                                                                                                        self.centers[i, 2], \
-                                                                                                                       self.cforce[i, 0], \
-                                                                                                                       self.cforce[i, 1], \
-                                                                                                                       self.cforce[i, 2], \
+                                                                                                                       cforce[i, 0], \
+                                                                                                                       cforce[i, 1], \
+                                                                                                                       cforce[i, 2], \
                                                                                                                        self.area[i, 0], \
                                                                                                                        self.area[i, 1], \
                                                                                                                        self.area[i, 2], \
                                                                                                                        self.area[i, 3]))                 
-        
-        self.intmesh2(fout2)
     
   
      
     def pressure_on_elements_centers(self):
         
-        self.pressures_on_centers = np.empty(self.nelements)
+        # Element center pressures from the grid pressures, one sparse product
+        # for one case or all the columns of a batch
+        if self.averaging is None:
+            self.build_averaging()
+            
+        self.pressures_on_centers = self.averaging @ self.press
         
-        for i in range(self.nelements):
-            if (self.mesh_type == 3):
-                self.pressures_on_centers[i] = (self.grids[int(self.press[i, 0]) - 1] + self.grids[int(self.press[i, 1]) - 1] + self.grids[int(self.press[i, 2]) - 1]) / 3
-            elif (self.mesh_type == 4):
-                self.pressures_on_centers[i] = 0.25 * (self.grids[int(self.press[i, 0]) - 1] + self.grids[int(self.press[i, 1]) - 1] + self.grids[int(self.press[i, 2]) - 1] + self.grids[int(self.press[i, 3]) - 1])
+        return self.pressures_on_centers
+    
+    
+    def build_averaging(self, weighted=False):
+        
+        # Sparse (nelements, ngrids) operator averaging the grid pressures of
+        # every element: 1 / nnodes each, or with weighted=True the share of
+        # the element area nearest to each grid, cut by the lines joining the
+        # center to the edge midpoints (1 / 3 each for triangles)
+        used = np.arange(self.mesh_type) < self.nnodes[:, None]
+        weights = np.where(used, 1.0 / self.nnodes[:, None], 0.0)
+        
+        quad = np.flatnonzero(self.nnodes == 4)
+        if weighted and len(quad):
+            corners = self.grids[self.conn[quad]].astype(np.float64, copy=False)    # (nquads, 4, 3)
+            center = corners.mean(axis=1)[:, None, :]
+            after = 0.5 * (corners + np.roll(corners, -1, axis=1))      # midpoint of the edge k, k + 1
+            before = np.roll(after, 1, axis=1)                           # midpoint of the edge k - 1, k
+            share = 0.5 * (np.linalg.norm(np.cross(after - corners, center - corners), axis=2) +
+                           np.linalg.norm(np.cross(center - corners, before - corners), axis=2))
+            weights[quad] = share / share.sum(axis=1)[:, None]
+            
+        rows = np.repeat(np.arange(self.nelements), self.nnodes)
+        self.averaging = csr_matrix((weights[used].astype(self.dtype), (rows, self.conn[used])),
+                                    shape=(self.nelements, self.ngrids))
         
         
     def allocate_press(self, npt):
         self.press = np.zeros(npt)
 
 
+    def build_connectivity(self):
+        
+        # Zero-based grid rows of every element, (nelements, mesh_type).
+        # A quad mesh may mix in triangles written with a 0 as fourth grid:
+        # their third grid is repeated, so every row has the same width.
+        used = self.elements > 0
+        self.conn = np.zeros_like(self.elements)
+        self.conn[used] = self.grid_rows(self.elements[used])
+        self.nnodes = np.count_nonzero(used, axis=1)      # Grids per element
+        
+        if (self.mesh_type == 4):
+            tri = self.nnodes == 3
+            self.conn[tri, 3] = self.conn[tri, 2]
+            
+            
     def calc_panel_centers(self):
         
-        for i in range(self.nelements):
-            if (self.mesh_type == 3):
-                self.centers[i, 0] = (self.grids[int(self.elements[i, 0]) - 1, 0] + self.grids[int(self.elements[i, 1]) - 1, 0] + self.grids[int(self.elements[i, 2]) - 1, 0]) / 3
-                self.centers[i, 1] = (self.grids[int(self.elements[i, 0]) - 1, 1] + self.grids[int(self.elements[i, 1]) - 1, 1] + self.grids[int(self.elements[i, 2]) - 1, 1]) / 3
-                self.centers[i, 2] = (self.grids[int(self.elements[i, 0]) - 1, 2] + self.grids[int(self.elements[i, 1]) - 1, 2] + self.grids[int(self.elements[i, 2]) - 1, 2]) / 3
-            elif (self.mesh_type == 4):
-                self.centers[i, 0] = 0.25 * (self.grids[int(self.elements[i, 0]) - 1, 0] + self.grids[int(self.elements[i, 1]) - 1, 0] + self.grids[int(self.elements[i, 2]) - 1, 0] + self.grids[int(self.elements[i, 3]) - 1, 0])
-                self.centers[i, 1] = 0.25 * (self.grids[int(self.elements[i, 0]) - 1, 1] + self.grids[int(self.elements[i, 1]) - 1, 1] + self.grids[int(self.elements[i, 2]) - 1, 1] + self.grids[int(self.elements[i, 3]) - 1, 1])
-                self.centers[i, 2] = 0.25 * (self.grids[int(self.elements[i, 0]) - 1, 2] + self.grids[int(self.elements[i, 1]) - 1, 2] + self.grids[int(self.elements[i, 2]) - 1, 2] + self.grids[int(self.elements[i, 3]) - 1, 2])
+        self.build_connectivity()
+        self.arms = None
+        
+        panel_grids = self.grids[self.conn]     # (nelements, mesh_type, 3)
+        sum3 = panel_grids[:, 0] + panel_grids[:, 1] + panel_grids[:, 2]
+        
+        if (self.mesh_type == 3):
+            self.centers[:, :] = sum3 / 3
+        elif (self.mesh_type == 4):
+            self.centers[:, :] = np.where((self.nnodes == 3)[:, None], sum3 / 3, 0.25 * (sum3 + panel_grids[:, 3]))
     
         
     
     def calc_area(self):
-         
-        for i in range(self.nelements):
-            if (self.mesh_type == 3):
-                points = tuple(self.grids[[int(self.elements[i, 0]) - 1, int(self.elements[i, 1]) - 1, int(self.elements[i, 2]) - 1], 0:3])
-                self.area[i, 0:3] = self.calculate_triangle_area_3d(points)
-            elif (self.mesh_type == 4):
-                points = tuple(self.grids[[int(self.elements[i, 0]) - 1, int(self.elements[i, 1]) - 1, int(self.elements[i, 2]) - 1, int(self.elements[i, 3]) - 1], 0:3])
-                self.area[i, 0:3] = self.calculate_quadrilateral_area_3d(points)
-            self.area[i, 3] = (self.area[i, 0] ** 2 + self.area[i, 1] ** 2 + self.area[i, 2] ** 2) ** 0.5
+        
+        panel_grids = self.grids[self.conn]     # (nelements, mesh_type, 3)
+        points = tuple(panel_grids[:, k] for k in range(3))
+        
+        if (self.mesh_type == 3):
+            self.area[:, 0:3] = self.calculate_triangle_area_3d(points)
+        elif (self.mesh_type == 4):
+            self.area[:, 0:3] = self.calculate_quadrilateral_area_3d(points + (panel_grids[:, 3],))
+            tri = self.nnodes == 3
+            if tri.any():
+                self.area[tri, 0:3] = self.calculate_triangle_area_3d(tuple(p[tri] for p in points))
+                
+        self.area[:, 3] = (self.area[:, 0] ** 2 + self.area[:, 1] ** 2 + self.area[:, 2] ** 2) ** 0.5
                 
                 
                 
@@ -242,293 +504,109 @@ class Surface:
     
     
     
-    def write_press_grids(self, fout):
+    def write_press_grids(self, fout, fmt="vtk"):
         
         filepath = os.path.join(self.results_dir, fout)
-        filepath_vtk = filepath.replace(".txt", ".vtk")
         
-        with open(filepath, 'w') as file: 
-            for i in range(self.ngrids):
-                file.write("{:12.6f}\n".format(self.press[i]))
-                
-                
-        with open(filepath_vtk, 'w') as file:
-            
-            file.write("# vtk DataFile Version 3.0\n")
-            file.write("vtk output\n")
-            file.write("ASCII\n")
-            file.write("DATASET UNSTRUCTURED_GRID\n\n")
-            file.write("POINTS {:8d} float\n".format(self.ngrids))
-            
-            for i in range(int(self.ngrids)):
-                file.write("{:12.6f} {:12.6f} {:12.6f}\n".format(self.grids[i, 0], self.grids[i, 1], self.grids[i, 2]))
-                
-            file.write("\n")
-            file.write("CELLS {:8d} {:8d}\n".format(self.nelements, self.nelements * (int(self.mesh_type + 1))))
-            
-            for i in range(self.nelements):
-                if (int(self.mesh_type) == 3):
-                    file.write("{:8d} {:8d} {:8d} {:8d}\n".format(int(self.mesh_type), self.elements[i, 0], self.elements[i, 1], self.elements[i, 2] ))
-                elif (int(self.mesh_type) == 4):
-                    file.write("{:8d} {:8d} {:8d} {:8d} {:8d}\n".format(int(self.mesh_type), int(self.elements[i, 0])-1, int(self.elements[i, 1])-1, int(self.elements[i, 2])-1, int(self.elements[i, 3])-1))
-                    
-            file.write("\n")
-            file.write("CELL_TYPES {:8d}\n".format(self.nelements))
-            
-            for i in range(self.nelements):
-                file.write("9\n")
-
-            file.write("\n")
+        np.savetxt(filepath, self.press[:self.ngrids], fmt="%12.6f")
+        
+        self.write_mesh(fout, point_data={"dcp": self.press[:self.ngrids]}, fmt=fmt)
             
-            file.write("POINT_DATA {:8d}\n".format(self.ngrids))
-            file.write("SCALARS dcp float\n")
-            file.write("LOOKUP_TABLE default\n")
-            file.write("\n")
-            for i in range(self.ngrids):
-                file.write("{:12.6f} \n".format(self.press[i]))
             
-    def write_press_elements(self, fout):
+    def write_press_elements(self, fout, fmt="vtk"):
         
         filepath = os.path.join(self.results_dir, fout)
-        filepath_vtk = filepath.replace(".txt", ".vtk")
         
-        with open(filepath, 'w') as file: 
-            for i in range(self.nelements):
-                file.write("{:12.6f}\n".format(self.press[i])) 
-
-        with open(filepath_vtk, 'w') as file:
-            
-            file.write("# vtk DataFile Version 3.0\n")
-            file.write("vtk output\n")
-            file.write("ASCII\n")
-            file.write("DATASET UNSTRUCTURED_GRID\n\n")
-            file.write("POINTS {:8d} float\n".format(self.ngrids))
-            
-            for i in range(int(self.ngrids)):
-                file.write("{:12.6f} {:12.6f} {:12.6f}\n".format(self.grids[i, 0], self.grids[i, 1], self.grids[i, 2]))
-                
-            file.write("\n")
-            file.write("CELLS {:8d} {:8d}\n".format(self.nelements, self.nelements * (int(self.mesh_type + 1))))
-            
-            for i in range(self.nelements):
-                if (int(self.mesh_type) == 3):
-                    file.write("{:8d} {:8d} {:8d} {:8d}\n".format(int(self.mesh_type), int(self.elements[i, 0]) - 1, int(self.elements[i, 1]) - 1 , int(self.elements[i, 2]) - 1))
-                elif (int(self.mesh_type) == 4):
-                    file.write("{:8d} {:8d} {:8d} {:8d} {:8d}\n".format(int(self.mesh_type), int(self.elements[i, 0]) - 1, int(self.elements[i, 1]) - 1, int(self.elements[i, 2]) - 1, int(self.elements[i, 3]) - 1))
-                    
-            file.write("\n")
-            file.write("CELL_TYPES {:8d}\n".format(self.nelements))
-            
-            for i in range(self.nelements):
-                file.write("9\n")
-
-            file.write("\n")
-            
-            file.write("CELL_DATA {:8d}\n".format(self.nelements))
-            file.write("SCALARS dcp float\n")
-            file.write("LOOKUP_TABLE default\n")
-            file.write("\n")
-            for i in range(self.nelements):
-                file.write("{:12.6f} \n".format(self.press[i]))
+        np.savetxt(filepath, self.press[:self.nelements], fmt="%12.6f")
+        
+        self.write_mesh(fout, cell_data={"dcp": self.press[:self.nelements], "area": self.area[:, 0:3]}, fmt=fmt)
+        
+        
+    def write_mesh(self, fout, point_data=None, cell_data=None, fmt="vtk"):
+        
+        # fmt: vtk (binary legacy), vtk-ascii or vtu (XML, raw appended data)
+        filepath = os.path.join(self.results_dir, fout)
+        root = filepath[:-4] if filepath.endswith(".txt") else filepath
+        
+        if fmt == "vtu":
+            write_vtu(root + ".vtu", self.grids, self.conn, self.nnodes, point_data, cell_data)
+        else:
+            write_vtk(root + ".vtk", self.grids, self.conn, self.nnodes, point_data, cell_data, binary=(fmt != "vtk-ascii"))
                 
                 
 
-    def intmesh(self, fout):
+    def moment_arms(self):
         
-        filepath = os.path.join(self.results_dir, fout)
-        self.forces = np.zeros((self.nelements, 3))
-        self.moments = np.zeros((self.nelements, 3))
-        self.distance = np.zeros((self.nelements, 3))
-        self.refpoint = np.zeros(3)
-        self.refcs = np.zeros((4, 3))
-        self.refcsvec = np.zeros((3, 3))
-        self.rotated_forces = np.zeros((self.nelements, 3))
-        self.rotated_moments = np.zeros((self.nelements, 3))
-        self.integrated_forces = np.zeros(3)
-        self.integrated_moments = np.zeros(3)
-        
-        cspath = os.path.join(self.resources_dir, "cs.txt")
-
-        with open(cspath, 'r') as f1:
-            #
-            line = f1.readline()
-            #
-            line = f1.readline()
-            temp = line.split()
-            self.refpoint[0:3] = list(map(float, temp[0:3]))
-            #
-            line = f1.readline()            
-            #
-            line = f1.readline()
-            temp = line.split()
-            self.refcs[0, 0:3] = list(map(float, temp[0:3]))
-            #
-            line = f1.readline()
-            temp = line.split()
-            self.refcs[1, 0:3] = list(map(float, temp[0:3]))
-            #
-            line = f1.readline()
-            temp = line.split()
-            self.refcs[2, 0:3] = list(map(float, temp[0:3]))
-            #
-            line = f1.readline()
-            temp = line.split()
-            self.refcs[3, 0:3] = list(map(float, temp[0:3]))
-            #
-            line = f1.readline()
-            #
-            line = f1.readline()
-            temp = line.split()            
-            self.aref = float(temp[0])
-            #
-            line = f1.readline()
-            temp = line.split()            
-            self.cref = float(temp[0])
-            #
-            line = f1.readline()
-            temp = line.split()            
-            self.bref = float(temp[0])            
-                                                
-            
-        for i in range(3):
-            self.refcsvec[0, i] = self.refcs[1, i] - self.refpoint[i]    # Coordinate System Vectors
-            self.refcsvec[1, i] = self.refcs[2, i] - self.refpoint[i]
-            self.refcsvec[2, i] = self.refcs[3, i] - self.refpoint[i]
-
-
-        for i in range(self.nelements):
-            self.forces[i, 0] = self.press[i] * self.area[i, 0] # Fx
-            self.forces[i, 1] = self.press[i] * self.area[i, 1] # Fy
-            self.forces[i, 2] = self.press[i] * self.area[i, 2] # Fz
-            for j in range(3):
-                self.distance[i, j] = self.centers[i, j] - self.refpoint[j]
-            
-            #a = np.cross(self.forces[i, 0:3], self.distance)
-            #print(a)
-            self.moments[i, 0:3] = np.cross(self.forces[i, 0:3], self.distance[i, 0:3])  # Mx, My, Mz
+        # Element centers relative to the reference point, once per mesh
+        frame = Frame.load(self.cspath)
+        
+        if self.arms is None or frame is not self.frame:
+            self.frame = frame
+            self.arms = (self.centers - frame.refpoint).astype(self.dtype, copy=False)
             
-            #b = np.dot(self.refcsvec, self.forces)
-            #print(b)
-            self.rotated_forces[i, 0:3] = np.dot(self.refcsvec, self.forces[i, 0:3])
-            self.rotated_moments[i, 0:3] = np.dot(self.refcsvec, self.moments[i, 0:3])
+        return self.arms
+    
+    
+    def integrate(self, forces):
         
-
-        self.integrated_forces[0] = np.sum(self.rotated_forces[:, 0]) / self.aref
-        self.integrated_forces[1] = np.sum(self.rotated_forces[:, 1]) / self.aref
-        self.integrated_forces[2] = np.sum(self.rotated_forces[:, 2]) / self.aref
+        # forces: element forces, (nelements, 3) or (nelements, 3, ncases)
+        arms = self.moment_arms()
         
-        self.integrated_moments[0] = np.sum(self.rotated_forces[:, 0]) / (self.aref * self.bref)
-        self.integrated_moments[1] = np.sum(self.rotated_forces[:, 1]) / (self.aref * self.cref)
-        self.integrated_moments[2] = np.sum(self.rotated_forces[:, 2]) / (self.aref * self.bref)
+        self.integrated_forces, self.integrated_moments, self.resultant_moments = self.frame.integrate(forces, arms)
         
+        return self.integrated_forces, self.integrated_moments
+    
+    
+    def integrate_partial(self, forces, rows):
         
-        with open(filepath, 'w') as f2:    
-            f2.write("{:12.6f} {:12.6f} {:12.6f} {:12.6f} {:12.6f} {:12.6f}\n".format(self.integrated_forces[0], \
-                                                                                      self.integrated_forces[1], \
-                                                                                      self.integrated_forces[2], \
-                                                                                      self.integrated_moments[0], \
-                                                                                      self.integrated_moments[1], \
-                                                                                      self.integrated_moments[2]))
-            
-            
-            
-    def intmesh2(self, fout):
+        # forces: forces of the elements in rows only
+        # Force and moment sums, added up over chunks then passed to integrate_sums
+        self.moment_arms()
         
-        filepath = os.path.join(self.results_dir, fout)
-        self.forces = np.zeros((self.nelements, 3))
-        self.moments = np.zeros((self.nelements, 3))
-        self.distance = np.zeros((self.nelements, 3))
-        self.refpoint = np.zeros(3)
-        self.refcs = np.zeros((4, 3))
-        self.refcsvec = np.zeros((3, 3))
-        self.rotated_forces = np.zeros((self.nelements, 3))
-        self.rotated_moments = np.zeros((self.nelements, 3))
-        self.integrated_forces = np.zeros(3)
-        self.integrated_moments = np.zeros(3)
-        
-        cspath = os.path.join(self.resources_dir, "cs.txt")
-
-        with open(cspath, 'r') as f1:
-            #
-            line = f1.readline()
-            #
-            line = f1.readline()
-            temp = line.split()
-            self.refpoint[0:3] = list(map(float, temp[0:3]))
-            #
-            line = f1.readline()            
-            #
-            line = f1.readline()
-            temp = line.split()
-            self.refcs[0, 0:3] = list(map(float, temp[0:3]))
-            #
-            line = f1.readline()
-            temp = line.split()
-            self.refcs[1, 0:3] = list(map(float, temp[0:3]))
-            #
-            line = f1.readline()
-            temp = line.split()
-            self.refcs[2, 0:3] = list(map(float, temp[0:3]))
-            #
-            line = f1.readline()
-            temp = line.split()
-            self.refcs[3, 0:3] = list(map(float, temp[0:3]))
-            #
-            line = f1.readline()
-            #
-            line = f1.readline()
-            temp = line.split()            
-            self.aref = float(temp[0])
-            #
-            line = f1.readline()
-            temp = line.split()            
-            self.cref = float(temp[0])
-            #
-            line = f1.readline()
-            temp = line.split()            
-            self.bref = float(temp[0])            
-                                                
-            
-        for i in range(3):
-            self.refcsvec[0, i] = self.refcs[1, i] - self.refpoint[i]    # Coordinate System Vectors
-            self.refcsvec[1, i] = self.refcs[2, i] - self.refpoint[i]
-            self.refcsvec[2, i] = self.refcs[3, i] - self.refpoint[i]
-
-
-        for i in range(self.nelements):
-            self.forces[i, 0] = self.cforce[i, 0] # Fx
-            self.forces[i, 1] = self.cforce[i, 1] # Fy
-            self.forces[i, 2] = self.cforce[i, 2] # Fz
-            for j in range(3):
-                self.distance[i, j] = self.centers[i, j] - self.refpoint[j]
-            
-            #a = np.cross(self.forces[i, 0:3], self.distance)
-            #print(a)
-            self.moments[i, 0:3] = np.cross(self.forces[i, 0:3], self.distance[i, 0:3])  # Mx, My, Mz
+        return self.frame.resultants(forces, self.arms[rows])
+    
+    
+    def integrate_sums(self, force_sum, moment_sum):
+        
+        self.integrated_forces, self.integrated_moments, self.resultant_moments = self.frame.coefficients(force_sum, moment_sum)
+        
+        return self.integrated_forces, self.integrated_moments
+    
+    
+    def intmesh(self, fout):
+        
+        # Pressure x area forces on the elements, pressures on grids are taken
+        # from the last pressure_on_elements_centers
+        press = self.press if self.averaging is None else self.pressures_on_centers
+        
+        if press.ndim == 1:
+            forces = press[:, None] * self.area[:, 0:3]
+        else:
+            forces = press[:, None, :] * self.area[:, 0:3, None]
             
-            #b = np.dot(self.refcsvec, self.forces)
-            #print(b)
-            self.rotated_forces[i, 0:3] = np.dot(self.refcsvec, self.forces[i, 0:3])
-            self.rotated_moments[i, 0:3] = np.dot(self.refcsvec, self.moments[i, 0:3])
+        self.integrate(forces)
         
-
-        self.integrated_forces[0] = np.sum(self.rotated_forces[:, 0]) / self.aref
-        self.integrated_forces[1] = np.sum(self.rotated_forces[:, 1]) / self.aref
-        self.integrated_forces[2] = np.sum(self.rotated_forces[:, 2]) / self.aref
+        if fout is not None:
+            self.write_coefficients(fout, self.integrated_forces, self.integrated_moments)
         
-        self.integrated_moments[0] = np.sum(self.rotated_forces[:, 0]) / (self.aref * self.bref)
-        self.integrated_moments[1] = np.sum(self.rotated_forces[:, 1]) / (self.aref * self.cref)
-        self.integrated_moments[2] = np.sum(self.rotated_forces[:, 2]) / (self.aref * self.bref)
         
+    def intmesh2(self, fout):
+        
+        # Projected forces on the cells
+        self.integrate(self.cforce)
+        
+        if fout is not None:
+            self.write_coefficients(fout, self.integrated_forces, self.integrated_moments)
+    
+    
+    def write_coefficients(self, fout, integrated_forces, integrated_moments):
+        
+        filepath = os.path.join(self.results_dir, fout)
         
         with open(filepath, 'w') as f2:    
-            f2.write("{:12.6f} {:12.6f} {:12.6f} {:12.6f} {:12.6f} {:12.6f}\n".format(self.integrated_forces[0], \
-                                                                                      self.integrated_forces[1], \
-                                                                                      self.integrated_forces[2], \
-                                                                                      self.integrated_moments[0], \
-                                                                                      self.integrated_moments[1], \
-                                                                                      self.integrated_moments[2]))
-            
-            
-            
-        
\ No newline at end of file
+            f2.write("{:12.6f} {:12.6f} {:12.6f} {:12.6f} {:12.6f} {:12.6f}\n".format(integrated_forces[0], \
+                                                                                      integrated_forces[1], \
+                                                                                      integrated_forces[2], \
+                                                                                      integrated_moments[0], \
+                                                                                      integrated_moments[1], \
+                                                                                      integrated_moments[2]))
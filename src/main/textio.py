@@ -0,0 +1,155 @@
+# -*- coding: utf-8 -*-
+import os
+import itertools
+import numpy as np
+
+
+def read_table(filepath, header=False, sidecar=True):
+
+    # Whitespace separated numeric table as a 2-D float array.
+    # header: first line holds the number of rows that follow
+    # sidecar: keep a binary copy next to the text file (filepath + ".npy")
+    # and memory-map it instead of parsing while it is strictly newer than the text
+
+    npypath = filepath + ".npy"
+
+    if sidecar and fresh(filepath, npypath):
+        try:
+            return np.load(npypath, mmap_mode='r')
+        except (OSError, ValueError):
+            pass
+
+    table = parse_table(filepath, header)
+
+    if sidecar:
+        # Write then rename, a reader never maps a partial file
+        tmppath = "{}.{}.tmp".format(npypath, os.getpid())
+        try:
+            with open(tmppath, 'wb') as file:
+                np.save(file, table)
+            os.replace(tmppath, npypath)
+        except OSError:    # read-only data directory
+            pass
+
+    return table
+
+
+def parse_table(filepath, header=False):
+
+    with open(filepath, 'r') as file:
+        nrows = None
+        if header:
+            nrows = int(file.readline().split()[0])      # Number of rows
+        text = file.read()
+
+    tokens = text.split()
+    lines, widths = row_widths(text, 2 if header else 1)
+
+    if len(widths) == 0 and not nrows:
+        return np.empty((0, 0))
+
+    if nrows is None:
+        nrows = len(widths)
+    elif nrows > len(widths):
+        raise ValueError("{}: {:d} rows instead of {:d}".format(filepath, len(widths), nrows))
+
+    # Every row has the width of the first one, a short row is an error.
+    # Mixed meshes write a 0 for the missing grid of a triangle.
+    width = widths[0]
+    bad = np.flatnonzero(widths[:nrows] != width)
+    if len(bad):
+        raise ValueError("{}, line {:d}: {:d} columns instead of {:d}".format(filepath, lines[bad[0]], widths[bad[0]], width))
+
+    # Rows of equal width are converted in one pass
+    return np.array(tokens[:nrows * width], dtype=float).reshape(nrows, width)
+
+
+def row_widths(text, first=1):
+
+    # Line numbers and number of fields of the non-blank lines of text, first:
+    # line number of its first line. Counted on the bytes in one pass, control
+    # characters count as blanks (a field holding one is not a number anyway).
+    data = np.frombuffer(text.encode(), dtype=np.uint8)
+    space = data <= 32
+
+    start = ~space
+    start[1:] &= space[:-1]             # first byte of every field
+    bounds = np.r_[0, np.flatnonzero(data == ord("\n")) + 1, len(data)]
+    widths = np.diff(np.searchsorted(np.flatnonzero(start), bounds))
+
+    lines = np.flatnonzero(widths)
+    return lines + first, widths[lines]
+
+
+def fresh(filepath, npypath):
+
+    # The sidecar is valid when written after the last edit of the text. An
+    # edit in the same mtime tick makes the times equal, the text wins.
+    return os.path.exists(npypath) and os.path.getmtime(npypath) > os.path.getmtime(filepath)
+
+
+def table_width(filepath, sidecar=True):
+
+    # Number of columns, from the sidecar when valid or the first text row
+    npypath = filepath + ".npy"
+
+    if sidecar and fresh(filepath, npypath):
+        return np.load(npypath, mmap_mode='r').shape[1]
+
+    with open(filepath, 'r') as file:
+        for line in file:
+            if line.strip():
+                return len(line.split())
+
+    return 0
+
+
+def iter_table(filepath, chunk_rows, nrows=None, sidecar=True):
+
+    # Rows of a headerless table by blocks of at most chunk_rows rows. Only
+    # one block is held in memory at a time. nrows: number of rows the table
+    # must have, fewer or more is an error once the reader gets there.
+    npypath = filepath + ".npy"
+    chunk_rows = max(int(chunk_rows), 1)
+
+    if sidecar and fresh(filepath, npypath):
+        table = np.load(npypath, mmap_mode='r')
+        if nrows is not None and len(table) != nrows:
+            raise ValueError("{}: {:d} rows instead of {:d}".format(filepath, len(table), nrows))
+        for r0 in range(0, len(table), chunk_rows):
+            yield np.array(table[r0:r0 + chunk_rows])
+        return
+
+    width = None
+    done = 0
+    lines = []
+    numbers = []        # line numbers of lines
+
+    def block():
+        # Rows of lines, all of the width of the first row of the table
+        widths = row_widths("".join(lines))[1]
+        bad = np.flatnonzero(widths != width)
+        if len(bad):
+            raise ValueError("{}, line {:d}: {:d} columns instead of {:d}".format(filepath, numbers[bad[0]], widths[bad[0]], width))
+        return np.array("".join(lines).split(), dtype=float).reshape(len(lines), width)
+
+    with open(filepath, 'r') as file:
+        for n, line in enumerate(file, 1):
+            if not line.strip():
+                continue
+            if done == nrows:
+                raise ValueError("{}, line {:d}: more than {:d} rows".format(filepath, n, nrows))
+            if width is None:
+                width = len(line.split())
+            lines.append(line)
+            numbers.append(n)
+            done += 1
+            if len(lines) == chunk_rows:
+                yield block()
+                lines, numbers = [], []
+
+    if lines:
+        yield block()
+
+    if nrows is not None and done < nrows:
+        raise ValueError("{}: {:d} rows instead of {:d}".format(filepath, done, nrows))
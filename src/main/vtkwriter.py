@@ -0,0 +1,118 @@
+# -*- coding: utf-8 -*-
+import numpy as np
+
+
+CELL_TYPES = {3: 5, 4: 9}       # VTK_TRIANGLE, VTK_QUAD
+
+
+def cell_arrays(conn, nnodes):
+
+    # Connectivity without the padding of mixed meshes, cell offsets and types
+    mask = np.arange(conn.shape[1])[None, :] < nnodes[:, None]
+    connectivity = conn[mask]
+    offsets = np.cumsum(nnodes)
+    types = np.where(nnodes == 3, CELL_TYPES[3], CELL_TYPES[4])
+
+    return connectivity, offsets, types
+
+
+def write_vtk(filepath, grids, conn, nnodes, point_data=None, cell_data=None, binary=True):
+
+    # Legacy VTK unstructured grid. Arrays of point_data / cell_data are
+    # written as SCALARS when 1-D and as VECTORS when (n, 3).
+    types = cell_arrays(conn, nnodes)[2]
+    ngrids = len(grids)
+    nelements = len(conn)
+
+    # Rows of the CELLS section: number of grids, then the grids
+    mask = np.arange(conn.shape[1])[None, :] < nnodes[:, None]
+    rows = np.column_stack((nnodes, conn))
+    cells = rows[np.column_stack((np.ones(nelements, dtype=bool), mask))]
+
+    with open(filepath, 'wb') as file:
+
+        def block(array, dtype, fmt):
+            if binary:
+                file.write(np.ascontiguousarray(array, dtype=dtype).tobytes())
+                file.write(b"\n")
+            else:
+                np.savetxt(file, array, fmt=fmt)
+
+        file.write(b"# vtk DataFile Version 3.0\n")
+        file.write(b"vtk output\n")
+        file.write(b"BINARY\n" if binary else b"ASCII\n")
+        file.write(b"DATASET UNSTRUCTURED_GRID\n")
+
+        file.write("POINTS {:d} float\n".format(ngrids).encode())
+        block(grids, '>f4', "%12.6f")
+
+        file.write("CELLS {:d} {:d}\n".format(nelements, len(cells)).encode())
+        if binary:
+            block(cells, '>i4', "%d")
+        elif np.all(nnodes == nnodes[0]):
+            np.savetxt(file, rows[:, 0:nnodes[0] + 1], fmt="%d")
+        else:   # mixed tri/quad rows
+            for row, k in zip(rows, nnodes):
+                file.write((" ".join(map(str, row[0:k + 1])) + "\n").encode())
+
+        file.write("CELL_TYPES {:d}\n".format(nelements).encode())
+        block(types, '>i4', "%d")
+
+        for section, count, data in (("POINT_DATA", ngrids, point_data), ("CELL_DATA", nelements, cell_data)):
+            if not data:
+                continue
+            file.write("{} {:d}\n".format(section, count).encode())
+            for name, array in data.items():
+                array = np.asarray(array)
+                if array.ndim == 1:
+                    file.write("SCALARS {} float 1\nLOOKUP_TABLE default\n".format(name).encode())
+                else:
+                    file.write("VECTORS {} float\n".format(name).encode())
+                block(array, '>f4', "%.7e")
+
+
+def write_vtu(filepath, grids, conn, nnodes, point_data=None, cell_data=None):
+
+    # XML unstructured grid with all arrays as raw appended binary data
+    connectivity, offsets, types = cell_arrays(conn, nnodes)
+
+    arrays = []         # raw bytes of the arrays, in offset order
+    position = [0]
+
+    def data_array(name, array, dtype, vtktype):
+        array = np.ascontiguousarray(array, dtype=dtype)
+        components = array.shape[1] if array.ndim == 2 else 1
+        tag = '<DataArray type="{}" Name="{}" NumberOfComponents="{:d}" format="appended" offset="{:d}"/>'.format(
+            vtktype, name, components, position[0])
+        raw = np.uint64(array.nbytes).tobytes() + array.tobytes()
+        position[0] += len(raw)
+        arrays.append(raw)
+        return tag
+
+    xml = ['<?xml version="1.0"?>',
+           '<VTKFile type="UnstructuredGrid" version="1.0" byte_order="LittleEndian" header_type="UInt64">',
+           '<UnstructuredGrid>',
+           '<Piece NumberOfPoints="{:d}" NumberOfCells="{:d}">'.format(len(grids), len(conn))]
+
+    for section, data in (("PointData", point_data), ("CellData", cell_data)):
+        xml.append("<{}>".format(section))
+        for name, array in (data or {}).items():
+            xml.append(data_array(name, array, '<f4', "Float32"))
+        xml.append("</{}>".format(section))
+
+    xml += ['<Points>', data_array("Points", grids, '<f4', "Float32"), '</Points>',
+            '<Cells>',
+            data_array("connectivity", connectivity, '<i4', "Int32"),
+            data_array("offsets", offsets, '<i4', "Int32"),
+            data_array("types", types, '<u1', "UInt8"),
+            '</Cells>',
+            '</Piece>',
+            '</UnstructuredGrid>',
+            '<AppendedData encoding="raw">']
+
+    with open(filepath, 'wb') as file:
+        file.write("\n".join(xml).encode())
+        file.write(b"\n_")
+        for raw in arrays:
+            file.write(raw)
+        file.write(b"\n</AppendedData>\n</VTKFile>\n")